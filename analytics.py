@@ -0,0 +1,173 @@
+import os
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+from process_local import ProcessLocal
+
+# Write-behind logging of processing sessions
+ANALYTICS_WRITE_BEHIND = os.environ.get('ANALYTICS_WRITE_BEHIND', 'true') == 'true'
+# Flush when this many records are queued...
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 100))
+# ...and at least every this many seconds otherwise
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 2.0))
+# Records kept in memory while the database is unreachable; the oldest are dropped beyond this
+ANALYTICS_MAX_BUFFER = int(os.environ.get('ANALYTICS_MAX_BUFFER', 10000))
+# Longest wait between retries while the database is failing
+MAX_RETRY_DELAY = 60.0
+# Seconds dashboard aggregates are served from memory before being recomputed
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 30))
+
+
+class WriteBehindLogger:
+    """Queue records in memory and write them in bulk from a background thread
+
+    flush_fn receives a list of records and must raise if they were not
+    written; failed batches go back to the front of the queue and are
+    retried with backoff, so a database outage only costs memory up to
+    max_buffer records.
+    """
+
+    def __init__(self, flush_fn, batch_size, flush_interval, max_buffer):
+        self.flush_fn = flush_fn
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = ProcessLocal(self._start_thread)
+        self._closed = False
+        self._retry_delay = 0.0
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+        thread.start()
+        return thread
+
+    def log(self, record):
+        """Queue a record for writing; never blocks on the database"""
+        with self._lock:
+            if len(self._queue) >= self.max_buffer:
+                self._queue.popleft()
+                self.dropped += 1
+                if self.dropped % 100 == 1:
+                    logging.warning(f"Analytics buffer full, {self.dropped} records dropped so far")
+            self._queue.append(record)
+            queued = len(self._queue)
+            if not self._closed:
+                self._thread.get()
+        if queued >= self.batch_size:
+            self._wakeup.set()
+
+    def _take_batch(self):
+        with self._lock:
+            count = min(self.batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _requeue(self, records):
+        with self._lock:
+            # Put the batch back in order ahead of newer records, within the buffer limit
+            room = self.max_buffer - len(self._queue)
+            if room < len(records):
+                self.dropped += len(records) - room
+                records = records[len(records) - room:] if room > 0 else []
+            self._queue.extendleft(reversed(records))
+
+    def flush(self):
+        """Write everything queued; returns False if the database write failed"""
+        with self._flush_lock:
+            while True:
+                records = self._take_batch()
+                if not records:
+                    self._retry_delay = 0.0
+                    return True
+                try:
+                    start = time.perf_counter()
+                    self.flush_fn(records)
+                    self.flushed += len(records)
+                    logging.debug(f"Flushed {len(records)} analytics records in {(time.perf_counter() - start) * 1000:.1f}ms")
+                except Exception as e:
+                    self.failures += 1
+                    self._requeue(records)
+                    self._retry_delay = min(MAX_RETRY_DELAY, max(self.flush_interval, self._retry_delay * 2))
+                    logging.error(f"Analytics flush failed, retrying in {self._retry_delay:.1f}s: {str(e)}")
+                    return False
+
+    def _run(self):
+        while not self._closed:
+            if self._retry_delay:
+                # Back off while the database is failing, however full the queue gets
+                self._stop.wait(self._retry_delay)
+            else:
+                self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and write out whatever is still queued"""
+        self._closed = True
+        self._stop.set()
+        self._wakeup.set()
+        if self.flush() is False:
+            logging.error(f"Analytics records lost at shutdown: {len(self._queue)}")
+
+    def stats(self):
+        """Counters describing the logger's state"""
+        with self._lock:
+            queued = len(self._queue)
+        return {'queued': queued, 'flushed': self.flushed, 'dropped': self.dropped, 'failures': self.failures}
+
+
+class TTLCache:
+    """Cache of computed values that expire after ttl seconds or on invalidate()
+
+    Only one thread recomputes an expired value; others wait for it rather
+    than all running the same queries at once.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """The cached value for key, calling compute() if it is missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+            value = compute()
+            # A write that landed while computing makes the value stale already
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+
+    def invalidate(self):
+        """Drop every cached value"""
+        self._generation += 1
+        self._entries.clear()
+
+    def stats(self):
+        """Hit and miss counters"""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'ttl': self.ttl}
+
+
+def create_write_behind_logger(flush_fn):
+    """Build the write-behind logger from configuration, flushing it at shutdown"""
+    logger = WriteBehindLogger(flush_fn, ANALYTICS_BATCH_SIZE, ANALYTICS_FLUSH_INTERVAL, ANALYTICS_MAX_BUFFER)
+    atexit.register(logger.close)
+    return logger
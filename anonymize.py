@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+
+# Smallest kernel used by the blur methods, whatever strength is requested
+MIN_KERNEL = 5
+# Pixelation cells across the shorter side of a face at strength 100; fewer cells = stronger
+PIXELATE_SCALE = 400
+MIN_PIXELATE_CELLS = 4
+# Colour of solid fills (BGR)
+FILL_COLOR = (0, 0, 0)
+
+
+def kernel_size(strength):
+    """Odd kernel size for a blur strength"""
+    return max(MIN_KERNEL, int(strength) | 1)
+
+
+def gaussian_blur(region, strength):
+    """Gaussian blur; cost grows with strength"""
+    ksize = kernel_size(strength)
+    return cv2.GaussianBlur(region, (ksize, ksize), 0)
+
+
+def box_blur(region, strength):
+    """Box blur computed with running sums, so cost does not depend on strength"""
+    ksize = kernel_size(strength)
+    return cv2.blur(region, (ksize, ksize))
+
+
+def stack_blur(region, strength):
+    """Stack blur: close to Gaussian in look, at a cost that does not depend on strength"""
+    ksize = kernel_size(strength)
+    return cv2.stackBlur(region, (ksize, ksize))
+
+
+def pixelate(region, strength):
+    """Mosaic of flat cells made by downscaling and upscaling the region"""
+    h, w = region.shape[:2]
+    cells = max(MIN_PIXELATE_CELLS, PIXELATE_SCALE // max(1, int(strength)))
+    cell_size = max(1, min(h, w) // cells)
+    small = cv2.resize(region, (max(1, w // cell_size), max(1, h // cell_size)), interpolation=cv2.INTER_AREA)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+
+
+def solid_fill(region, strength):
+    """Cover the region with a flat colour"""
+    filled = np.empty_like(region)
+    if region.ndim == 3:
+        # Broadcasting one full row is much faster than broadcasting a single pixel
+        filled[:] = np.tile(np.array(FILL_COLOR[:region.shape[2]], dtype=region.dtype), (region.shape[1], 1))
+    else:
+        filled[:] = FILL_COLOR[0]
+    return filled
+
+
+BLUR_METHODS = {
+    'gaussian': gaussian_blur,
+    'box': box_blur,
+    'stack': stack_blur,
+    'pixelate': pixelate,
+    'fill': solid_fill,
+}
+
+MASK_SHAPES = ('rectangle', 'ellipse')
+
+
+def ellipse_mask(h, w):
+    """8-bit mask of the ellipse inscribed in an h x w box"""
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.ellipse(mask, (w // 2, h // 2), (max(1, w // 2), max(1, h // 2)), 0, 0, 360, 255, -1)
+    return mask
+
+
+def anonymize_region(region, strength, method='gaussian', shape='rectangle'):
+    """Anonymize an image region in place with a registered blur method
+
+    With shape 'ellipse' only the ellipse inscribed in the region is changed.
+    Raises ValueError for an unknown method or shape.
+    """
+    blur = BLUR_METHODS.get(method)
+    if blur is None:
+        raise ValueError(f"Unknown blur method: {method}")
+    if shape not in MASK_SHAPES:
+        raise ValueError(f"Unknown blur shape: {shape}")
+    anonymized = blur(region, strength)
+    if shape == 'ellipse':
+        # Masked copy straight into the region; far cheaper than boolean indexing
+        cv2.copyTo(anonymized, ellipse_mask(*region.shape[:2]), region)
+    else:
+        region[...] = anonymized
@@ -1,21 +1,37 @@
 import os
 import logging
 import uuid
-import cv2
-import numpy as np
-import json
+import re
+import mimetypes
 import time
-from datetime import date
-from PIL import Image, ExifTags
-from PIL.ExifTags import TAGS
+from datetime import date, datetime, timedelta
 from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import inspect as sqlalchemy_inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
 from werkzeug.utils import secure_filename
-import io
-import base64
+from jobs import job_queue, job_store, QueueFullError
+from analytics import ANALYTICS_WRITE_BEHIND, STATS_CACHE_TTL, TTLCache, create_write_behind_logger
+from batch import (BATCH_MAX_BYTES, BATCH_MAX_FILES, BatchError, get_batch_executor, is_archive,
+                   iter_archive_images, reset_batch_executor, write_archive)
+from concurrent.futures.process import BrokenProcessPool
+from anonymize import BLUR_METHODS, MASK_SHAPES
+from detectors import DETECTORS, warm_up_detectors
+from retention import RETENTION_SWEEP_INTERVAL, RETENTION_SWEEPER, RetentionSweeper
+from video import VIDEO_EXTENSIONS
+from tiling import MEMORY_BUDGET_MB, PROCESSING_MODES, MemoryBudgetExceeded
+from encoding import ENCODER_PRESET, ENCODER_PRESETS, FORMAT_EXTENSIONS, output_format_for
+from coordinates import CoordinateError, empty_face_boxes, parse_face_coordinates
+from structured_logging import configure_logging, log_fields
+from metrics import METRICS_DIR, METRICS_ENABLED, PERSIST_STAGE_TIMINGS, ProcessingMetrics
+from processing import (SERVER_DETECTION_METHODS, boxes_to_coordinates, preview_store, process_image,
+                        process_image_timed, processed_store, result_cache, upload_store)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging: LOG_LEVEL and LOG_FORMAT
+configure_logging()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-key-change-in-production")
@@ -49,20 +65,110 @@ else:
     logging.warning("No DATABASE_URL found - running without database functionality")
 
 # Configuration
-UPLOAD_FOLDER = 'uploads'
-PROCESSED_FOLDER = 'processed'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'} | VIDEO_EXTENSIONS
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+DETECTION_METHODS = ('client', 'hybrid') + SERVER_DETECTION_METHODS
+PREVIEW_MAX_AGE = 3600  # seconds browsers may cache a preview
+# Hand file transfers to the front proxy: Apache/lighttpd X-Sendfile, or an nginx
+# internal location prefix for X-Accel-Redirect (e.g. /protected/)
+DOWNLOAD_X_SENDFILE = os.environ.get('DOWNLOAD_X_SENDFILE', 'false') == 'true'
+DOWNLOAD_ACCEL_REDIRECT = os.environ.get('DOWNLOAD_ACCEL_REDIRECT', '')
+app.config['USE_X_SENDFILE'] = DOWNLOAD_X_SENDFILE
+# The largest request is a full batch; the extra 1MB leaves room for the other form fields
+app.config['MAX_CONTENT_LENGTH'] = BATCH_MAX_BYTES + 1024 * 1024
 
-# Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+# The processing module's file stores, result cache and the job records are expired and kept under quota
+# by each worker's sweeper
+retention_sweeper = RetentionSweeper([upload_store, processed_store, preview_store, job_store] +
+                                     ([result_cache] if result_cache is not None else []), RETENTION_SWEEP_INTERVAL)
+
+# Stage and request timings, summed across the workers sharing METRICS_DIR and served on /metrics
+processing_metrics = ProcessingMetrics(directory=METRICS_DIR) if METRICS_ENABLED else None
+
+# Load face detectors at worker boot so the first request isn't a latency outlier
+if os.environ.get('WARMUP_DETECTORS', 'true') == 'true':
+    warm_up_detectors()
+
+def create_missing_tables():
+    """Create declared tables that don't exist yet, as create_all would
+
+    Every worker runs this at startup, racing the others, so each table is
+    created with IF NOT EXISTS. A table that still doesn't exist afterwards
+    is an error.
+    """
+    for table in db.metadata.sorted_tables:
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(CreateTable(table, if_not_exists=True))
+        except Exception:
+            if not sqlalchemy_inspect(db.engine).has_table(table.name):
+                raise
+
+def create_missing_indexes():
+    """Add indexes declared since their tables were created
+
+    Every worker runs this at startup, racing the others, so each index is
+    created with IF NOT EXISTS and a failure is logged without disabling
+    the database.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+            except Exception as e:
+                logging.warning(f"Could not create index {index.name}: {str(e)}")
+
+# Columns that replace an older one, filled in from it when they are added:
+# (table, column) -> (older column, value expression)
+COLUMN_BACKFILLS = {
+    ('processing_stats', 'total_processing_time_ms'): (
+        'avg_processing_time_ms',
+        'COALESCE(avg_processing_time_ms, 0) * COALESCE(total_images_processed, 0)'),
+}
+
+def table_column_names(table):
+    """Names of the columns a table has in the database"""
+    return {column['name'] for column in sqlalchemy_inspect(db.engine).get_columns(table.name)}
+
+def add_missing_columns():
+    """Add nullable columns declared since their tables were created
+
+    Workers race to do this at startup. PostgreSQL adds columns with IF NOT
+    EXISTS; elsewhere a column another worker added first is recognised
+    after the failed ALTER. Other failures are logged per column without
+    disabling the database. Columns in COLUMN_BACKFILLS are filled in the
+    same transaction as the ALTER.
+    """
+    dialect = db.engine.dialect
+    if_not_exists = 'IF NOT EXISTS ' if dialect.name == 'postgresql' else ''
+    for table in db.metadata.sorted_tables:
+        existing = table_column_names(table)
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=dialect)
+            backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+            try:
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{column.name} {column_type}')
+                    if backfill and backfill[0] in existing:
+                        connection.exec_driver_sql(
+                            f'UPDATE {table.name} SET {column.name} = {backfill[1]} '
+                            f'WHERE {column.name} IS NULL')
+                logging.info(f"Added column {table.name}.{column.name}")
+            except Exception as e:
+                if column.name not in table_column_names(table):
+                    logging.warning(f"Could not add column {table.name}.{column.name}: {str(e)}")
 
 # Create database tables
 if database_enabled:
     with app.app_context():
         try:
-            db.create_all()
+            create_missing_tables()
+            create_missing_indexes()
+            add_missing_columns()
             logging.info("Database tables created successfully")
         except Exception as e:
             logging.error(f"Database initialization error: {str(e)}")
@@ -73,504 +179,685 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def remove_metadata(image_path):
-    """Remove EXIF metadata from image"""
-    try:
-        # Open image
-        image = Image.open(image_path)
-        
-        # Create a new image without EXIF data
-        data = list(image.getdata())
-        image_without_exif = Image.new(image.mode, image.size)
-        image_without_exif.putdata(data)
-        
-        return image_without_exif
-    except Exception as e:
-        logging.error(f"Error removing metadata: {str(e)}")
-        raise
+def write_processing_sessions(records):
+    """Bulk-insert processing session records and their face detections in one transaction
 
-def blur_faces_from_coordinates(image_path, face_coordinates, blur_strength=50):
-    """Apply blur to specific face coordinates"""
-    try:
-        # Load the image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError("Could not load image")
-        
-        faces_processed = 0
-        
-        if face_coordinates:
-            logging.info(f"Processing {len(face_coordinates)} face coordinates for blurring")
-            
-            # Apply blur to each face region
-            for i, face in enumerate(face_coordinates):
-                try:
-                    x = int(face['x'])
-                    y = int(face['y']) 
-                    w = int(face['width'])
-                    h = int(face['height'])
-                    
-                    logging.info(f"Face {i+1}: x={x}, y={y}, w={w}, h={h} (image size: {img.shape[1]}x{img.shape[0]})")
-                    
-                    # Ensure coordinates are within image bounds
-                    x = max(0, min(x, img.shape[1] - 1))
-                    y = max(0, min(y, img.shape[0] - 1))
-                    w = max(1, min(w, img.shape[1] - x))
-                    h = max(1, min(h, img.shape[0] - y))
-                    
-                    # Add some padding around the face for better coverage
-                    padding = max(5, min(w, h) // 10)
-                    x = max(0, x - padding)
-                    y = max(0, y - padding)
-                    w = min(img.shape[1] - x, w + 2 * padding)
-                    h = min(img.shape[0] - y, h + 2 * padding)
-                    
-                    logging.info(f"Face {i+1} adjusted: x={x}, y={y}, w={w}, h={h}")
-                    
-                    # Extract face region
-                    face_region = img[y:y+h, x:x+w]
-                    
-                    if face_region.size > 0 and face_region.shape[0] > 0 and face_region.shape[1] > 0:
-                        # Apply Gaussian blur (ensure odd blur values)
-                        blur_val = max(5, blur_strength if blur_strength % 2 == 1 else blur_strength + 1)
-                        blurred_face = cv2.GaussianBlur(face_region, (blur_val, blur_val), 0)
-                        
-                        # Replace original face with blurred version
-                        img[y:y+h, x:x+w] = blurred_face
-                        faces_processed += 1
-                        logging.info(f"Successfully blurred face {i+1}")
-                    else:
-                        logging.warning(f"Face {i+1} region is empty or invalid")
-                        
-                except (KeyError, ValueError, TypeError) as e:
-                    logging.error(f"Invalid face coordinates for face {i+1}: {e}")
-                    continue
+    Raises on failure so the write-behind logger can retry the batch.
+    """
+    session_rows = []
+    face_rows = []
+    daily_totals = {}
+    
+    for record in records:
+        session_rows.append({
+            'id': record['id'],
+            'created_at': record['created_at'],
+            'user_ip': record['user_ip'],
+            'user_agent': record['user_agent'],
+            'original_filename': record['original_filename'],
+            'original_file_size': record['original_size'],
+            'processed_file_size': record['processed_size'],
+            'metadata_removed': record['metadata_removed'],
+            'faces_detected': record['faces_detected'],
+            'faces_blurred': record['faces_blurred'],
+            'blur_strength': record['blur_strength'],
+            'processing_success': record.get('success', True),
+            'error_message': record.get('error_msg'),
+            'processing_time_ms': record['processing_time_ms'],
+            'stage_timings_ms': record.get('stage_timings') if PERSIST_STAGE_TIMINGS else None,
+        })
         
-        logging.info(f"Processed {faces_processed} out of {len(face_coordinates)} faces for blurring")
-        return img, faces_processed
-    except Exception as e:
-        logging.error(f"Error in face blurring: {str(e)}")
-        raise
-
-def detect_and_blur_faces_opencv(image_path, blur_strength=50):
-    """Detect and blur faces using OpenCV Haar cascades"""
+        # Log individual face detections
+        if record['face_coordinates'] and record.get('success', True):
+            for i, face in enumerate(record['face_coordinates']):
+                face_rows.append({
+                    'id': str(uuid.uuid4()),
+                    'session_id': record['id'],
+                    'face_index': i + 1,
+                    'confidence_score': face.get('confidence', 0.0),
+                    'box_x': face['x'],
+                    'box_y': face['y'],
+                    'box_width': face['width'],
+                    'box_height': face['height'],
+                    'dominant_expression': face.get('expression', 'unknown'),
+                    'expression_confidence': face.get('expression_confidence', 0.0),
+                    'created_at': record['created_at'],
+                })
+        
+        # Aggregate daily stats so each day's row is updated once per batch
+        totals = daily_totals.setdefault(record['day'], {
+            'images': 0, 'original_size': 0, 'processed_size': 0, 'metadata_removed': 0,
+            'faces_detected': 0, 'faces_blurred': 0, 'processing_time_ms': 0,
+        })
+        totals['images'] += 1
+        totals['original_size'] += record['original_size']
+        totals['processed_size'] += record['processed_size']
+        totals['metadata_removed'] += int(bool(record['metadata_removed']))
+        totals['faces_detected'] += record['faces_detected']
+        totals['faces_blurred'] += int(bool(record['faces_blurred']))
+        totals['processing_time_ms'] += record['processing_time_ms']
+    
     try:
-        # Load the image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError("Could not load image")
-        
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Initialize face cascade classifier
-        # Try multiple cascade files for better detection
-        cascade_files = [
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml',
-            cv2.data.haarcascades + 'haarcascade_frontalface_alt.xml',
-            cv2.data.haarcascades + 'haarcascade_frontalface_alt2.xml'
-        ]
-        
-        all_faces = []
-        
-        for cascade_file in cascade_files:
-            try:
-                face_cascade = cv2.CascadeClassifier(cascade_file)
-                if face_cascade.empty():
-                    continue
-                    
-                # Detect faces with stricter parameters to reduce false positives
-                faces = face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.2,
-                    minNeighbors=8,
-                    minSize=(50, 50),
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
-                
-                # Add detected faces to the list with quality filtering
-                for (x, y, w, h) in faces:
-                    # Basic quality filtering - skip very small or unusually shaped faces
-                    if w < 40 or h < 40 or w/h > 2.0 or h/w > 2.0:
-                        continue
-                    
-                    # Check if this face overlaps significantly with existing faces
-                    is_duplicate = False
-                    for existing_face in all_faces:
-                        ex, ey, ew, eh = existing_face
-                        # Calculate overlap using IoU (Intersection over Union)
-                        overlap_x = max(0, min(x + w, ex + ew) - max(x, ex))
-                        overlap_y = max(0, min(y + h, ey + eh) - max(y, ey))
-                        overlap_area = overlap_x * overlap_y
-                        
-                        face_area = w * h
-                        existing_area = ew * eh
-                        union_area = face_area + existing_area - overlap_area
-                        
-                        if union_area > 0:
-                            iou = overlap_area / union_area
-                            if iou > 0.3:  # 30% IoU threshold
-                                # Keep the larger face
-                                if face_area > existing_area:
-                                    all_faces.remove(existing_face)
-                                else:
-                                    is_duplicate = True
-                                break
-                    
-                    if not is_duplicate:
-                        all_faces.append((x, y, w, h))
-                        
-            except Exception as e:
-                logging.warning(f"Error with cascade {cascade_file}: {str(e)}")
-                continue
-        
-        # Apply blur to detected faces
-        faces_processed = 0
+        # executemany-style inserts: one statement per table for the whole batch
+        db.session.execute(db.insert(ProcessingSession), session_rows)
+        if face_rows:
+            db.session.execute(db.insert(FaceDetection), face_rows)
         
-        for (x, y, w, h) in all_faces:
-            # Add padding around face for better coverage
-            padding = max(5, min(w, h) // 10)
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(img.shape[1] - x, w + 2 * padding)
-            h = min(img.shape[0] - y, h + 2 * padding)
-            
-            # Extract face region
-            face_region = img[y:y+h, x:x+w]
-            
-            if face_region.size > 0:
-                # Apply Gaussian blur
-                blur_val = max(5, blur_strength if blur_strength % 2 == 1 else blur_strength + 1)
-                blurred_face = cv2.GaussianBlur(face_region, (blur_val, blur_val), 0)
-                
-                # Replace original face with blurred version
-                img[y:y+h, x:x+w] = blurred_face
-                faces_processed += 1
-        
-        logging.info(f"OpenCV detected and blurred {faces_processed} faces using {len(cascade_files)} cascades")
-        
-        # Convert face coordinates to the expected format
-        detected_face_coords = []
-        for (x, y, w, h) in all_faces:
-            detected_face_coords.append({
-                'x': int(x),
-                'y': int(y), 
-                'width': int(w),
-                'height': int(h)
-            })
-        
-        return img, faces_processed, detected_face_coords
+        # Update daily stats
+        for day, totals in daily_totals.items():
+            update_daily_stats(day=day, **totals)
         
-    except Exception as e:
-        logging.error(f"Error in OpenCV face detection: {str(e)}")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
         raise
+    stats_cache.invalidate()
 
-def get_image_metadata(image_path):
-    """Extract metadata information from image"""
-    try:
-        image = Image.open(image_path)
-        exifdata = image.getexif()
-        
-        metadata = {}
-        if exifdata is not None:
-            for tag_id in exifdata:
-                tag = TAGS.get(tag_id, tag_id)
-                data = exifdata.get(tag_id)
-                if isinstance(data, bytes):
-                    data = data.decode()
-                metadata[tag] = data
-        
-        return metadata
-    except Exception as e:
-        logging.error(f"Error extracting metadata: {str(e)}")
-        return {}
+def flush_processing_sessions(records):
+    """Write-behind flush callback: bulk-write records inside an app context"""
+    with app.app_context():
+        write_processing_sessions(records)
+
+# Session records are queued and written in bulk off the request path
+analytics_logger = None
+if database_enabled and ANALYTICS_WRITE_BEHIND:
+    analytics_logger = create_write_behind_logger(flush_processing_sessions)
 
-def image_to_base64(image_path):
-    """Convert image to base64 for display"""
+def log_processing_sessions(records):
+    """Log processing sessions (dicts of log_processing_session arguments) to the database"""
+    if not database_enabled or not records:
+        return []
+    
+    # Stamp records now, since write-behind may write them much later
+    records = [dict(record, id=str(uuid.uuid4()), created_at=datetime.utcnow(), day=date.today())
+               for record in records]
+    
+    if analytics_logger is not None:
+        for record in records:
+            analytics_logger.log(record)
+        return [record['id'] for record in records]
+    
     try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
+        write_processing_sessions(records)
+        logging.debug("Logged %d processing sessions", len(records))
+        return [record['id'] for record in records]
     except Exception as e:
-        logging.error(f"Error converting image to base64: {str(e)}")
-        return None
+        logging.error(f"Error logging processing sessions: {str(e)}")
+        return []
 
 def log_processing_session(user_ip, user_agent, original_filename, original_size, processed_size, 
                           metadata_removed, faces_detected, faces_blurred, blur_strength, 
-                          face_coordinates, processing_time_ms, success=True, error_msg=None):
+                          face_coordinates, processing_time_ms, success=True, error_msg=None, stage_timings=None):
     """Log processing session to database"""
-    if not database_enabled:
-        return None
-    
-    try:
-        # Create processing session
-        session = ProcessingSession(
-            user_ip=user_ip,
-            user_agent=user_agent,
-            original_filename=original_filename,
-            original_file_size=original_size,
-            processed_file_size=processed_size,
-            metadata_removed=metadata_removed,
-            faces_detected=faces_detected,
-            faces_blurred=faces_blurred,
-            blur_strength=blur_strength,
-            processing_success=success,
-            error_message=error_msg,
-            processing_time_ms=processing_time_ms
-        )
-        
-        db.session.add(session)
-        db.session.flush()  # Get the session ID
-        
-        # Log individual face detections
-        if face_coordinates and success:
-            for i, face in enumerate(face_coordinates):
-                face_detection = FaceDetection(
-                    session_id=session.id,
-                    face_index=i + 1,
-                    confidence_score=face.get('confidence', 0.0),
-                    box_x=face['x'],
-                    box_y=face['y'],
-                    box_width=face['width'],
-                    box_height=face['height'],
-                    dominant_expression=face.get('expression', 'unknown'),
-                    expression_confidence=face.get('expression_confidence', 0.0)
-                )
-                db.session.add(face_detection)
-        
-        # Update daily stats
-        update_daily_stats(original_size, processed_size, metadata_removed, 
-                          faces_detected, faces_blurred, processing_time_ms)
-        
-        db.session.commit()
-        logging.info(f"Processing session logged: {session.id}")
-        return session.id
-        
-    except Exception as e:
-        db.session.rollback()
-        logging.error(f"Error logging processing session: {str(e)}")
-        return None
+    session_ids = log_processing_sessions([dict(
+        user_ip=user_ip,
+        user_agent=user_agent,
+        original_filename=original_filename,
+        original_size=original_size,
+        processed_size=processed_size,
+        metadata_removed=metadata_removed,
+        faces_detected=faces_detected,
+        faces_blurred=faces_blurred,
+        blur_strength=blur_strength,
+        face_coordinates=face_coordinates,
+        processing_time_ms=processing_time_ms,
+        success=success,
+        error_msg=error_msg,
+        stage_timings=stage_timings
+    )])
+    return session_ids[0] if session_ids else None
 
 def update_daily_stats(original_size, processed_size, metadata_removed, 
-                      faces_detected, faces_blurred, processing_time_ms):
-    """Update daily processing statistics"""
+                      faces_detected, faces_blurred, processing_time_ms, images=1, day=None):
+    """Atomically add to daily processing statistics
+
+    Values may be totals over several images; metadata_removed and
+    faces_blurred are then counts rather than flags. Counters are
+    incremented inside the database, so concurrent workers never lose
+    each other's updates.
+    """
+    today = day or date.today()
+    now = datetime.utcnow()
+    increments = {
+        'total_images_processed': images,
+        'total_faces_detected': faces_detected,
+        'total_metadata_removals': int(metadata_removed),
+        'total_face_blurs': int(faces_blurred),
+        # File sizes are stored in MB
+        'total_original_size_mb': original_size / (1024 * 1024),
+        'total_processed_size_mb': processed_size / (1024 * 1024),
+        'total_processing_time_ms': float(processing_time_ms),
+    }
+    stats_table = ProcessingStats.__table__
+    dialect = db.session.get_bind().dialect.name
+    
+    if dialect in ('postgresql', 'sqlite'):
+        # INSERT ... ON CONFLICT (date) DO UPDATE SET col = col + excluded.col
+        insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+        statement = insert(stats_table).values(date=today, created_at=now, updated_at=now, **increments)
+        updates = {
+            column: db.func.coalesce(stats_table.c[column], 0) + statement.excluded[column]
+            for column in increments
+        }
+        statement = statement.on_conflict_do_update(
+            index_elements=[stats_table.c.date],
+            set_={**updates, 'updated_at': now}
+        )
+        db.session.execute(statement)
+        return
+    
+    # Other databases: increment in place, inserting the day's row if it is missing
+    update = stats_table.update().where(stats_table.c.date == today).values(
+        updated_at=now,
+        **{column: db.func.coalesce(stats_table.c[column], 0) + value for column, value in increments.items()}
+    )
+    if db.session.execute(update).rowcount:
+        return
     try:
-        today = date.today()
-        stats = ProcessingStats.query.filter_by(date=today).first()
-        
-        if not stats:
-            stats = ProcessingStats(date=today)
-            db.session.add(stats)
-        
-        # Update counters
-        stats.total_images_processed = (stats.total_images_processed or 0) + 1
-        stats.total_faces_detected = (stats.total_faces_detected or 0) + faces_detected
-        if metadata_removed:
-            stats.total_metadata_removals = (stats.total_metadata_removals or 0) + 1
-        if faces_blurred:
-            stats.total_face_blurs = (stats.total_face_blurs or 0) + 1
-        
-        # Update file sizes (convert to MB)
-        stats.total_original_size_mb = (stats.total_original_size_mb or 0.0) + (original_size / (1024 * 1024))
-        stats.total_processed_size_mb = (stats.total_processed_size_mb or 0.0) + (processed_size / (1024 * 1024))
-        
-        # Update average processing time
-        current_total_time = (stats.avg_processing_time_ms or 0.0) * ((stats.total_images_processed or 1) - 1)
-        stats.avg_processing_time_ms = (current_total_time + processing_time_ms) / (stats.total_images_processed or 1)
-        
-        stats.updated_at = datetime.utcnow()
-        
-    except Exception as e:
-        logging.error(f"Error updating daily stats: {str(e)}")
+        with db.session.begin_nested():
+            db.session.execute(stats_table.insert().values(date=today, created_at=now, updated_at=now, **increments))
+    except IntegrityError:
+        # Another worker inserted the row first
+        db.session.execute(update)
+
+@app.before_request
+def start_retention_sweeper():
+    """Start this worker's retention sweeper with its first request"""
+    if RETENTION_SWEEPER:
+        retention_sweeper.ensure_started()
 
 @app.route('/')
 def index():
     """Main page"""
     return render_template('index.html')
 
+class UploadError(Exception):
+    """An upload that fails validation, reported to the client as a 400"""
+
+def read_upload(file):
+    """Validate an uploaded file and return its secure filename and bytes"""
+    if file is None or file.filename == '':
+        raise UploadError('No file selected')
+    
+    if not allowed_file(file.filename):
+        raise UploadError('File type not allowed. Please use PNG, JPG, JPEG, WEBP, MP4, MOV, WEBM or AVI')
+    
+    # Check file size
+    file.seek(0, os.SEEK_END)
+    file_size = file.tell()
+    file.seek(0)
+    
+    if file_size > MAX_FILE_SIZE:
+        raise UploadError('File too large. Maximum size is 16MB')
+    
+    if file.filename is None:
+        raise UploadError('Invalid filename')
+    
+    # Read the upload into memory; pixels are decoded at most once later
+    return secure_filename(file.filename), file.read()
+
+def read_processing_options(form):
+    """Read processing options from a submitted form"""
+    # Face boxes from the frontend (JSON string), validated and bounded before any decoding
+    try:
+        face_coordinates = parse_face_coordinates(form.get('face_coordinates'))
+    except CoordinateError as e:
+        raise UploadError(str(e))
+    if len(face_coordinates):
+        logging.debug("Received %d face coordinates", len(face_coordinates))
+    
+    blur_method = form.get('blur_method', 'gaussian')
+    if blur_method not in BLUR_METHODS:
+        raise UploadError(f"Unknown blur method. Choose one of: {', '.join(BLUR_METHODS)}")
+    blur_shape = form.get('blur_shape', 'rectangle')
+    if blur_shape not in MASK_SHAPES:
+        raise UploadError(f"Unknown blur shape. Choose one of: {', '.join(MASK_SHAPES)}")
+    detection_method = form.get('detection_method', 'client')
+    if detection_method not in DETECTION_METHODS:
+        raise UploadError(f"Unknown detection method. Choose one of: {', '.join(DETECTION_METHODS)}")
+    if detection_method in DETECTORS and not DETECTORS[detection_method].available():
+        raise UploadError(f"The {detection_method} face detector is not available on this server")
+    processing_mode = form.get('processing_mode', 'auto')
+    if processing_mode not in PROCESSING_MODES:
+        raise UploadError(f"Unknown processing mode. Choose one of: {', '.join(PROCESSING_MODES)}")
+    try:
+        memory_budget_mb = int(form.get('memory_budget_mb', MEMORY_BUDGET_MB))
+    except ValueError:
+        memory_budget_mb = -1
+    if memory_budget_mb <= 0 and 'memory_budget_mb' in form:
+        raise UploadError('memory_budget_mb must be a positive whole number of megabytes')
+    if MEMORY_BUDGET_MB:
+        # Requests may lower the server's memory budget but not raise it
+        memory_budget_mb = min(MEMORY_BUDGET_MB, memory_budget_mb)
+
+    try:
+        blur_strength = int(form.get('blur_strength', 50))
+    except ValueError:
+        blur_strength = -1
+    if not 1 <= blur_strength <= 100:
+        raise UploadError('blur_strength must be a whole number from 1 to 100')
+
+    encoder_preset = form.get('encoder_preset', ENCODER_PRESET)
+    if encoder_preset not in ENCODER_PRESETS:
+        raise UploadError(f"Unknown encoder preset. Choose one of: {', '.join(ENCODER_PRESETS)}")
+    output_format = form.get('output_format', 'original').lower()
+    if output_format != 'original' and output_format_for(f".{output_format}", None) is None:
+        raise UploadError(f"Unknown output format. Choose one of: original, {', '.join(FORMAT_EXTENSIONS.values())}")
+    encoder_overrides = {}
+    if 'progressive' in form:
+        encoder_overrides['progressive'] = form.get('progressive') == 'true'
+    if 'lossless' in form:
+        encoder_overrides['lossless'] = form.get('lossless') == 'true'
+    if 'png_compress_level' in form:
+        try:
+            encoder_overrides['compress_level'] = int(form.get('png_compress_level'))
+        except ValueError:
+            encoder_overrides['compress_level'] = -1
+        if not 0 <= encoder_overrides['compress_level'] <= 9:
+            raise UploadError('png_compress_level must be a whole number from 0 to 9')
+
+    return {
+        'remove_meta': form.get('remove_metadata', 'true') == 'true',
+        'blur_faces': form.get('blur_faces', 'true') == 'true',
+        'blur_strength': blur_strength,
+        'blur_method': blur_method,
+        'blur_shape': blur_shape,
+        'processing_mode': processing_mode,
+        'memory_budget_mb': memory_budget_mb,
+        'detection_method': detection_method,
+        'face_coordinates': face_coordinates,
+        'preview_mode': form.get('preview_mode', 'inline'),
+        'output_format': None if output_format == 'original' else output_format_for(f".{output_format}"),
+        'encoder_preset': encoder_preset,
+        'encoder_overrides': encoder_overrides,
+    }
+
+def processing_result_record(user_ip, user_agent, filename, options, result, processing_time_ms):
+    """Session log arguments for a successful processing run"""
+    return dict(
+        user_ip=user_ip,
+        user_agent=user_agent,
+        original_filename=filename,
+        original_size=result['original_size'],
+        processed_size=result['processed_size'],
+        metadata_removed=options['remove_meta'],
+        faces_detected=result['faces_detected'],
+        faces_blurred=options['blur_faces'] and result['faces_detected'] > 0,
+        blur_strength=options['blur_strength'] if options['blur_faces'] else None,
+        # Client boxes plus server detections, which carry the detector's confidence when it has one
+        face_coordinates=boxes_to_coordinates(options['face_coordinates']) + result['face_coordinates'],
+        processing_time_ms=processing_time_ms,
+        success=True,
+        stage_timings=result.get('stage_timings_ms')
+    )
+
+def processing_failure_record(user_ip, user_agent, filename, processing_time_ms, error):
+    """Session log arguments for a failed processing attempt"""
+    return dict(
+        user_ip=user_ip,
+        user_agent=user_agent,
+        original_filename=filename,
+        original_size=0,
+        processed_size=0,
+        metadata_removed=False,
+        faces_detected=0,
+        faces_blurred=False,
+        blur_strength=None,
+        face_coordinates=[],
+        processing_time_ms=processing_time_ms,
+        success=False,
+        error_msg=str(error)
+    )
+
+def log_processing_result(user_ip, user_agent, filename, options, result, processing_time_ms):
+    """Log a successful processing run to the database"""
+    if not database_enabled:
+        return None
+    return log_processing_session(**processing_result_record(user_ip, user_agent, filename, options,
+                                                             result, processing_time_ms))
+
+def log_processing_failure(user_ip, user_agent, filename, processing_time_ms, error):
+    """Log a failed processing attempt to the database"""
+    if not database_enabled:
+        return None
+    return log_processing_session(**processing_failure_record(user_ip, user_agent, filename,
+                                                              processing_time_ms, error))
+
+def record_processing_metrics(endpoint, options, result, processing_time_ms):
+    """Add a processed upload's stage timings to this worker's metrics"""
+    if processing_metrics is None:
+        return
+    detection_method = options['detection_method'] if options['blur_faces'] else 'none'
+    processing_metrics.observe(endpoint, detection_method, result.get('megapixels'),
+                               result.get('stage_timings_ms', {}), processing_time_ms)
+
+def record_processing_failure(endpoint, outcome='error'):
+    """Count a rejected or failed upload in this worker's metrics"""
+    if processing_metrics is not None:
+        processing_metrics.observe_failure(endpoint, outcome)
+
+def log_processing_summary(endpoint, filename, options, result, processing_time_ms, level=logging.INFO):
+    """One structured record summing up a processed upload: options, counts and stage timings"""
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    fields = {
+        'endpoint': endpoint,
+        'outcome': 'success',
+        'filename': filename,
+        'processing_time_ms': processing_time_ms,
+        'detection_method': options['detection_method'] if options['blur_faces'] else 'none',
+        'client_faces': len(options['face_coordinates']),
+        'server_faces': len(result['face_coordinates']),
+        'faces_detected': result['faces_detected'],
+        'megapixels': result.get('megapixels'),
+        'frames': result.get('frames'),
+        'original_size': result['original_size'],
+        'processed_size': result['processed_size'],
+        'processing_mode': result.get('processing_mode'),
+        'cached': result['cached'],
+        'stage_timings_ms': result.get('stage_timings_ms'),
+    }
+    log_fields(level, "Processed %s", filename, **{key: value for key, value in fields.items() if value is not None})
+
+def log_failure_summary(endpoint, filename, outcome, error, processing_time_ms=None, level=logging.WARNING):
+    """One structured record for a rejected or failed upload"""
+    fields = {'endpoint': endpoint, 'outcome': outcome, 'filename': filename, 'error': str(error),
+              'processing_time_ms': processing_time_ms}
+    log_fields(level, "Could not process %s: %s", filename, error,
+               **{key: value for key, value in fields.items() if value is not None})
+
+def get_client_info():
+    """Client IP and user agent of the current request"""
+    user_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
+    user_agent = request.environ.get('HTTP_USER_AGENT', 'unknown')
+    return user_ip, user_agent
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and processing"""
     start_time = time.time()
-    user_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', 'unknown'))
-    user_agent = request.environ.get('HTTP_USER_AGENT', 'unknown')
+    user_ip, user_agent = get_client_info()
+    file = request.files.get('file')
     
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file selected'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'File type not allowed. Please use PNG, JPG, JPEG, or WEBP'}), 400
-        
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({'error': 'File too large. Maximum size is 16MB'}), 400
-        
-        # Generate unique filename
-        if file.filename is None:
-            return jsonify({'error': 'Invalid filename'}), 400
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        
-        # Save uploaded file
-        file.save(file_path)
-        
-        # Extract original metadata
-        original_metadata = get_image_metadata(file_path)
-        
-        # Process options
-        remove_meta = request.form.get('remove_metadata', 'true') == 'true'
-        blur_faces = request.form.get('blur_faces', 'true') == 'true'
-        blur_strength = int(request.form.get('blur_strength', 50))
-        detection_method = request.form.get('detection_method', 'client')
-        
-        # Get face coordinates from frontend (JSON string)
-        face_coordinates_str = request.form.get('face_coordinates', '[]')
-        try:
-            face_coordinates = json.loads(face_coordinates_str)
-            logging.info(f"Received face coordinates: {face_coordinates}")
-        except (json.JSONDecodeError, TypeError):
-            face_coordinates = []
-            logging.warning("Failed to parse face coordinates")
-        
-        # Process the image
-        processed_filename = f"processed_{unique_filename}"
-        processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
-        
-        faces_detected = 0
-        server_face_coords = []
-        
-        if blur_faces:
-            if detection_method == 'server':
-                # Force server-side OpenCV detection
-                logging.info("Using OpenCV server-side face detection (forced)")
-                processed_img, faces_detected, server_face_coords = detect_and_blur_faces_opencv(file_path, blur_strength)
-                cv2.imwrite(processed_path, processed_img)
-            elif detection_method == 'hybrid':
-                # Use both client and server detection for maximum coverage
-                logging.info("Using hybrid face detection (client + server)")
-                client_faces = 0
-                server_faces = 0
-                
-                # Start with client-side coordinates if available
-                if face_coordinates:
-                    processed_img, client_faces = blur_faces_from_coordinates(file_path, face_coordinates, blur_strength)
-                    cv2.imwrite(processed_path, processed_img)
-                    
-                    # Then run server-side detection on the same image for additional faces
-                    additional_img, server_faces, additional_coords = detect_and_blur_faces_opencv(processed_path, blur_strength)
-                    cv2.imwrite(processed_path, additional_img)
-                    server_face_coords = additional_coords
-                else:
-                    # Only server-side if no client coordinates
-                    processed_img, server_faces, server_face_coords = detect_and_blur_faces_opencv(file_path, blur_strength)
-                    cv2.imwrite(processed_path, processed_img)
-                
-                faces_detected = client_faces + server_faces
-                logging.info(f"Hybrid detection: {client_faces} client faces + {server_faces} server faces = {faces_detected} total")
-            else:
-                # Default: client-side with server fallback
-                if face_coordinates:
-                    logging.info("Using client-side face detection coordinates")
-                    processed_img, faces_detected = blur_faces_from_coordinates(file_path, face_coordinates, blur_strength)
-                    cv2.imwrite(processed_path, processed_img)
-                else:
-                    logging.info("No client-side faces found, using OpenCV server-side detection")
-                    processed_img, faces_detected, server_face_coords = detect_and_blur_faces_opencv(file_path, blur_strength)
-                    cv2.imwrite(processed_path, processed_img)
-        else:
-            # Just copy the original if no face blurring
-            import shutil
-            shutil.copy2(file_path, processed_path)
-        
-        if remove_meta:
-            # Remove metadata
-            clean_image = remove_metadata(processed_path)
-            # Save with appropriate format and quality
-            if filename.lower().endswith(('.jpg', '.jpeg')):
-                clean_image.save(processed_path, 'JPEG', quality=95, optimize=True)
-            elif filename.lower().endswith('.png'):
-                clean_image.save(processed_path, 'PNG', optimize=True)
-            elif filename.lower().endswith('.webp'):
-                clean_image.save(processed_path, 'WEBP', quality=95, optimize=True)
-        
-        # Get file sizes
-        original_size = os.path.getsize(file_path)
-        processed_size = os.path.getsize(processed_path)
-        
-        # Convert images to base64 for preview
-        original_b64 = image_to_base64(file_path)
-        processed_b64 = image_to_base64(processed_path)
+        # Options first, so oversized coordinate payloads are turned away before the file is read
+        options = read_processing_options(request.form)
+        filename, image_data = read_upload(file)
+        result = process_image(image_data, filename, **options)
         
         # Calculate processing time
         processing_time_ms = int((time.time() - start_time) * 1000)
         
         # Log to database
-        if database_enabled:
-            log_processing_session(
-                user_ip=user_ip,
-                user_agent=user_agent,
-                original_filename=filename,
-                original_size=original_size,
-                processed_size=processed_size,
-                metadata_removed=remove_meta,
-                faces_detected=faces_detected,
-                faces_blurred=blur_faces and faces_detected > 0,
-                blur_strength=blur_strength if blur_faces else None,
-                face_coordinates=face_coordinates,
-                processing_time_ms=processing_time_ms,
-                success=True
-            )
-        
-        # Clean up original file
-        os.remove(file_path)
-        
-        return jsonify({
-            'success': True,
-            'processed_filename': processed_filename,
-            'original_metadata': original_metadata,
-            'faces_detected': faces_detected,
-            'face_coordinates': server_face_coords,
-            'original_size': original_size,
-            'processed_size': processed_size,
-            'size_reduction': round(((original_size - processed_size) / original_size) * 100, 1),
-            'original_image': original_b64,
-            'processed_image': processed_b64,
-            'processing_time_ms': processing_time_ms
-        })
-        
+        log_start = time.perf_counter()
+        log_processing_result(user_ip, user_agent, filename, options, result, processing_time_ms)
+        result['stage_timings_ms']['db_log'] = round((time.perf_counter() - log_start) * 1000, 1)
+        record_processing_metrics('upload', options, result, processing_time_ms)
+        log_processing_summary('upload', filename, options, result, processing_time_ms)
+        
+        return jsonify({'success': True, **result, 'processing_time_ms': processing_time_ms})
+        
+    except UploadError as e:
+        record_processing_failure('upload', 'rejected')
+        log_failure_summary('upload', getattr(file, 'filename', 'unknown'), 'rejected', e, level=logging.INFO)
+        return jsonify({'error': str(e)}), 400
+    except MemoryBudgetExceeded as e:
+        record_processing_failure('upload', 'rejected')
+        log_failure_summary('upload', getattr(file, 'filename', 'unknown'), 'rejected', e)
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
+        record_processing_failure('upload')
         # Calculate processing time for failed requests
         processing_time_ms = int((time.time() - start_time) * 1000)
         
         # Log failed processing attempt
-        if database_enabled:
-            log_processing_session(
-                user_ip=user_ip,
-                user_agent=user_agent,
-                original_filename=getattr(file, 'filename', 'unknown'),
-                original_size=0,
-                processed_size=0,
-                metadata_removed=False,
-                faces_detected=0,
-                faces_blurred=False,
-                blur_strength=None,
-                face_coordinates=[],
-                processing_time_ms=processing_time_ms,
-                success=False,
-                error_msg=str(e)
-            )
+        log_processing_failure(user_ip, user_agent, getattr(file, 'filename', 'unknown'), processing_time_ms, e)
         
-        logging.error(f"Upload error: {str(e)}")
+        log_failure_summary('upload', getattr(file, 'filename', 'unknown'), 'error', e, processing_time_ms,
+                            level=logging.ERROR)
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+
+def run_processing_job(user_ip, user_agent, filename, image_data, options):
+    """Process an image in a background job, logging it like a direct upload"""
+    start_time = time.time()
+    with app.app_context():
+        try:
+            result = process_image(image_data, filename, **options)
+            processing_time_ms = int((time.time() - start_time) * 1000)
+            log_start = time.perf_counter()
+            log_processing_result(user_ip, user_agent, filename, options, result, processing_time_ms)
+            result['stage_timings_ms']['db_log'] = round((time.perf_counter() - log_start) * 1000, 1)
+            record_processing_metrics('job', options, result, processing_time_ms)
+            log_processing_summary('job', filename, options, result, processing_time_ms)
+            return {'success': True, **result, 'processing_time_ms': processing_time_ms}
+        except Exception as e:
+            record_processing_failure('job')
+            processing_time_ms = int((time.time() - start_time) * 1000)
+            log_processing_failure(user_ip, user_agent, filename, processing_time_ms, e)
+            raise
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an upload for background processing and return its job id"""
+    user_ip, user_agent = get_client_info()
+    
+    try:
+        options = read_processing_options(request.form)
+        # Finished jobs are stored as records, so their previews are links rather than base64
+        if options['preview_mode'] == 'inline':
+            options['preview_mode'] = 'url'
+        filename, image_data = read_upload(request.files.get('file'))
+        job = job_queue.submit(run_processing_job, user_ip, user_agent, filename, image_data, options)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFullError as e:
+        logging.warning(f"Rejecting job: {str(e)}")
+        response = jsonify({'error': 'Server is busy. Please retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    except Exception as e:
+        logging.error(f"Job submission error: {str(e)}")
         return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('job_status', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status and timings of a background job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Result of a finished background job (202 while it is still pending)"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': f'Processing failed: {job.error}', **job.to_dict()}), 500
+    if not job.done:
+        return jsonify(job.to_dict()), 202
+    return jsonify({**job.result, 'job': job.to_dict()})
+
+def read_batch_uploads(files):
+    """Collect (filename, bytes, error) for every image in a batch, expanding archives"""
+    images = []
+    total_bytes = 0
+    
+    for file in files:
+        if file.filename and is_archive(file.filename):
+            # Packing barely shrinks images, so an archive bigger than the remaining budget cannot fit
+            file.seek(0, os.SEEK_END)
+            archive_size = file.tell()
+            file.seek(0)
+            if total_bytes + archive_size > BATCH_MAX_BYTES:
+                raise BatchError(f'Batch too large. Maximum is {BATCH_MAX_BYTES // (1024 * 1024)}MB of images')
+            archive_data = file.read()
+            members = iter_archive_images(archive_data, file.filename, allowed_file, MAX_FILE_SIZE)
+            entries = ((secure_filename(name), data, error) for name, data, error in members)
+        else:
+            try:
+                entries = [read_upload(file) + (None,)]
+            except UploadError as e:
+                entries = [(secure_filename(file.filename or 'unknown'), None, str(e))]
+        
+        for entry in entries:
+            images.append(entry)
+            total_bytes += len(entry[1] or b'')
+            if len(images) > BATCH_MAX_FILES:
+                raise BatchError(f'Too many images. Maximum is {BATCH_MAX_FILES} per batch')
+            if total_bytes > BATCH_MAX_BYTES:
+                raise BatchError(f'Batch too large. Maximum is {BATCH_MAX_BYTES // (1024 * 1024)}MB of images')
+    
+    return images
+
+@app.route('/batch', methods=['POST'])
+def batch_upload():
+    """Process many images (or zip/tar archives of images) with shared options"""
+    start_time = time.time()
+    user_ip, user_agent = get_client_info()
+    
+    try:
+        images = read_batch_uploads(request.files.getlist('files') + request.files.getlist('file'))
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    if not images:
+        return jsonify({'error': 'No images found in batch'}), 400
+    
+    # Client face coordinates belong to a single image, so batches use server-side detection
+    try:
+        options = read_processing_options(request.form)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    options['face_coordinates'] = empty_face_boxes()
+    options['preview_mode'] = 'none'
+    
+    # Fan the images out across worker processes, which keep their detectors loaded
+    executor = get_batch_executor()
+    futures = []
+    for filename, data, error in images:
+        future = None
+        if error is None:
+            future = executor.submit(process_image_timed, data, filename, **options)
+        futures.append((filename, future, error))
+    
+    results = []
+    log_records = []
+    archive_entries = []
+    for filename, future, error in futures:
+        if future is not None:
+            try:
+                result = future.result()
+                results.append({'filename': filename, 'success': True, **result})
+                log_records.append(processing_result_record(user_ip, user_agent, filename, options,
+                                                            result, result['processing_time_ms']))
+                record_processing_metrics('batch', options, result, result['processing_time_ms'])
+                # The batch as a whole gets the INFO summary
+                log_processing_summary('batch', filename, options, result, result['processing_time_ms'],
+                                       level=logging.DEBUG)
+                # Converted images keep their name but take the new extension
+                archive_name = f"{filename.rsplit('.', 1)[0]}.{result['processed_filename'].rsplit('.', 1)[-1]}"
+                archive_entries.append((archive_name, processed_store.path_for(result['processed_filename'])))
+                continue
+            except BrokenProcessPool as e:
+                reset_batch_executor()
+                error = f'Worker process failed: {str(e)}'
+            except Exception as e:
+                error = str(e)
+        record_processing_failure('batch', 'error' if future is not None else 'rejected')
+        log_failure_summary('batch', filename, 'error' if future is not None else 'rejected', error)
+        results.append({'filename': filename, 'success': False, 'error': error})
+        log_records.append(processing_failure_record(user_ip, user_agent, filename, 0, error))
+    
+    # One download for every processed image
+    archive_filename = None
+    if archive_entries:
+        archive_filename = f"processed_batch_{uuid.uuid4()}.zip"
+        with processed_store.writing(archive_filename) as archive_path:
+            write_archive(archive_path, archive_entries)
+    
+    # Log the whole batch to the database in one transaction
+    log_processing_sessions(log_records)
+    
+    processing_time_ms = int((time.time() - start_time) * 1000)
+    log_fields(logging.INFO, "Batch of %d images processed in %dms", len(images), processing_time_ms,
+               endpoint='batch', images=len(images), processed=len(archive_entries),
+               failed=len(results) - len(archive_entries), processing_time_ms=processing_time_ms)
+    
+    return jsonify({
+        'success': bool(archive_entries),
+        'results': results,
+        'processed_count': len(archive_entries),
+        'failed_count': len(results) - len(archive_entries),
+        'archive_filename': archive_filename,
+        'download_url': url_for('download_file', filename=archive_filename) if archive_filename else None,
+        'processing_time_ms': processing_time_ms
+    })
+
+# Dashboard aggregates, recomputed at most once per TTL or after new sessions are written
+stats_cache = TTLCache(STATS_CACHE_TTL)
+
+# Session fields shown on the dashboard; client IP and user agent are left out
+RECENT_SESSION_FIELDS = ('id', 'created_at', 'original_filename', 'original_file_size', 'processed_file_size',
+                         'metadata_removed', 'faces_detected', 'faces_blurred', 'processing_success',
+                         'processing_time_ms')
+DAILY_STATS_FIELDS = ('date', 'total_images_processed', 'total_faces_detected', 'total_metadata_removals',
+                      'total_face_blurs', 'total_original_size_mb', 'total_processed_size_mb',
+                      'avg_processing_time_ms')
+
+def daily_stats_to_dict(day_stats):
+    """Plain-dict copy of a ProcessingStats row that outlives its database session"""
+    if day_stats is None:
+        return None
+    return {field: getattr(day_stats, field) for field in DAILY_STATS_FIELDS}
+
+def compute_dashboard_stats():
+    """Run the dashboard queries and return the results as plain values"""
+    # Get today's stats
+    today = date.today()
+    today_stats = ProcessingStats.query.filter_by(date=today).first()
+    
+    # Get all-time totals
+    all_time_stats = db.session.query(
+        db.func.sum(ProcessingStats.total_images_processed).label('total_images'),
+        db.func.sum(ProcessingStats.total_faces_detected).label('total_faces'),
+        db.func.sum(ProcessingStats.total_metadata_removals).label('total_metadata'),
+        db.func.sum(ProcessingStats.total_face_blurs).label('total_blurs'),
+        db.func.sum(ProcessingStats.total_original_size_mb).label('total_original_mb'),
+        db.func.sum(ProcessingStats.total_processed_size_mb).label('total_processed_mb'),
+        (db.func.sum(ProcessingStats.total_processing_time_ms) /
+         db.func.nullif(db.func.sum(ProcessingStats.total_images_processed), 0)).label('avg_processing_time')
+    ).first()
+    
+    # Get recent processing sessions
+    recent_sessions = db.session.query(
+        *[getattr(ProcessingSession, field) for field in RECENT_SESSION_FIELDS]
+    ).order_by(ProcessingSession.created_at.desc()).limit(10).all()
+    
+    # Get last 7 days stats
+    week_ago = today - timedelta(days=7)
+    weekly_stats = ProcessingStats.query.filter(
+        ProcessingStats.date >= week_ago
+    ).order_by(ProcessingStats.date.desc()).all()
+    
+    return {
+        'today': daily_stats_to_dict(today_stats),
+        'all_time': all_time_stats._asdict() if all_time_stats is not None else None,
+        'weekly': [daily_stats_to_dict(day_stats) for day_stats in weekly_stats],
+        'recent_sessions': [row._asdict() for row in recent_sessions],
+        'today_date': today,
+    }
+
+def get_dashboard_stats():
+    """Dashboard aggregates from the cache, keyed by day so the cache rolls over at midnight"""
+    return stats_cache.get(date.today(), compute_dashboard_stats)
 
 @app.route('/stats')
 def stats_dashboard():
@@ -579,59 +866,123 @@ def stats_dashboard():
         return render_template('stats.html', database_enabled=False, stats=None, recent_sessions=None)
     
     try:
-        # Get today's stats
-        today = date.today()
-        today_stats = ProcessingStats.query.filter_by(date=today).first()
-        
-        # Get all-time totals
-        all_time_stats = db.session.query(
-            db.func.sum(ProcessingStats.total_images_processed).label('total_images'),
-            db.func.sum(ProcessingStats.total_faces_detected).label('total_faces'),
-            db.func.sum(ProcessingStats.total_metadata_removals).label('total_metadata'),
-            db.func.sum(ProcessingStats.total_face_blurs).label('total_blurs'),
-            db.func.sum(ProcessingStats.total_original_size_mb).label('total_original_mb'),
-            db.func.sum(ProcessingStats.total_processed_size_mb).label('total_processed_mb'),
-            db.func.avg(ProcessingStats.avg_processing_time_ms).label('avg_processing_time')
-        ).first()
-        
-        # Get recent processing sessions
-        recent_sessions = ProcessingSession.query.order_by(
-            ProcessingSession.created_at.desc()
-        ).limit(10).all()
-        
-        # Get last 7 days stats
-        from datetime import timedelta
-        week_ago = today - timedelta(days=7)
-        weekly_stats = ProcessingStats.query.filter(
-            ProcessingStats.date >= week_ago
-        ).order_by(ProcessingStats.date.desc()).all()
-        
-        stats_data = {
-            'today': today_stats,
-            'all_time': all_time_stats,
-            'weekly': weekly_stats,
-            'today_date': today
-        }
-        
+        stats_data = get_dashboard_stats()
         return render_template('stats.html', 
                              database_enabled=True, 
                              stats=stats_data, 
-                             recent_sessions=recent_sessions)
+                             recent_sessions=stats_data['recent_sessions'])
         
     except Exception as e:
         logging.error(f"Error loading stats: {str(e)}")
         return render_template('stats.html', database_enabled=False, stats=None, recent_sessions=None)
 
+def to_json_value(value):
+    """Convert dates and nested containers in stats to JSON-serialisable values"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: to_json_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_json_value(item) for item in value]
+    return value
+
+def service_stats():
+    """Counters for caches and storage, and detector status, that don't depend on the database"""
+    stats_data = {
+        'storage': {store.directory: store.stats() for store in retention_sweeper.stores
+                    if store is not result_cache},
+        'detectors': {name: detector.status() for name, detector in DETECTORS.items()},
+    }
+    if result_cache is not None:
+        stats_data['result_cache'] = result_cache.stats()
+    return stats_data
+
+@app.route('/api/stats')
+def stats_api():
+    """Dashboard statistics as JSON, for monitoring to poll without rendering the page"""
+    if not database_enabled:
+        return jsonify({'database_enabled': False, **service_stats()}), 503
+    
+    try:
+        stats_data = get_dashboard_stats()
+    except Exception as e:
+        logging.error(f"Error loading stats: {str(e)}")
+        return jsonify({'database_enabled': True, 'error': 'Statistics unavailable', **service_stats()}), 500
+    
+    response = to_json_value(stats_data)
+    response['database_enabled'] = True
+    response['cache'] = stats_cache.stats()
+    response.update(service_stats())
+    if analytics_logger is not None:
+        response['analytics'] = analytics_logger.stats()
+    return jsonify(response)
+
+@app.route('/metrics')
+def metrics():
+    """Stage timing histograms and upload counters of all workers, in the Prometheus text format"""
+    if processing_metrics is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return app.response_class(processing_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Stored outputs are named processed_<uuid>_<upload name> or processed_batch_<uuid>.zip
+STORED_NAME_PATTERN = re.compile(
+    r'^processed_(?P<batch>batch_)?[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_?(?P<name>.*)$')
+
+def download_name_for(stored_filename):
+    """Name offered to the browser for a stored output, without its unique id"""
+    match = STORED_NAME_PATTERN.match(stored_filename)
+    if match is None:
+        return f"privacy_protected_{stored_filename}"
+    if match.group('batch'):
+        return "privacy_protected_batch.zip"
+    return f"privacy_protected_{match.group('name')}"
+
+def send_stored_file(store, relative_path, mimetype=None, download_name=None, max_age=None):
+    """Send a file from a FileStore with conditional and Range request support
+
+    The stored names are unique, so files never change and browsers may
+    cache them; repeat requests are answered with 304 from the ETag.
+    With DOWNLOAD_ACCEL_REDIRECT set, nginx streams the file instead of
+    this worker. Otherwise send_file uses X-Sendfile when enabled, or the
+    server's wsgi.file_wrapper, which streams with sendfile() under gunicorn.
+    """
+    if DOWNLOAD_ACCEL_REDIRECT:
+        response = app.response_class(
+            mimetype=mimetype or mimetypes.guess_type(relative_path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{DOWNLOAD_ACCEL_REDIRECT.rstrip('/')}/{store.directory}/{relative_path}"
+        if download_name:
+            response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+        response.cache_control.max_age = max_age
+    else:
+        response = send_file(os.path.join(store.directory, relative_path), mimetype=mimetype,
+                             as_attachment=download_name is not None, download_name=download_name,
+                             conditional=True, etag=True, max_age=max_age)
+    # Outputs are user images, so only the browser may cache them
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = None
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/preview/<filename>')
+def preview_file(filename):
+    """Serve a cached preview thumbnail with ETag and Cache-Control headers"""
+    relative_path = preview_store.find(filename)
+    if relative_path is None:
+        return jsonify({'error': 'Preview not found'}), 404
+    return send_stored_file(preview_store, relative_path, mimetype='image/webp', max_age=PREVIEW_MAX_AGE)
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """Download processed file"""
     try:
-        file_path = os.path.join(PROCESSED_FOLDER, filename)
-        if not os.path.exists(file_path):
+        relative_path = processed_store.find(filename)
+        if relative_path is None:
             flash('File not found', 'error')
             return redirect(url_for('index'))
         
-        return send_file(file_path, as_attachment=True, download_name=f"privacy_protected_{filename[10:]}")
+        return send_stored_file(processed_store, relative_path, download_name=download_name_for(filename),
+                                max_age=processed_store.ttl)
     except Exception as e:
         logging.error(f"Download error: {str(e)}")
         flash('Download failed', 'error')
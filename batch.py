@@ -0,0 +1,111 @@
+import io
+import os
+import logging
+import multiprocessing
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from process_local import ProcessLocal
+
+# Worker processes used to process batch images in parallel. Every web worker (gunicorn's
+# WEB_CONCURRENCY) starts its own pool, so by default they share the cores, up to 4 each.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', max(1, min(4, (os.cpu_count() or 1) // WEB_CONCURRENCY))))
+# Limits on a single batch, counting every image inside uploaded archives
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 100))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 256 * 1024 * 1024))
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+class BatchError(Exception):
+    """A batch that cannot be accepted, reported to the client as a 400"""
+
+
+def is_archive(filename):
+    """Check if a filename looks like a supported archive"""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive_images(data, filename, allowed_file, max_file_size):
+    """Yield (name, bytes, error) for each image file inside a zip or tar archive
+
+    Members are read with a size cap so a compressed bomb cannot exhaust memory;
+    oversized members are yielded with an error instead of their bytes.
+    """
+    try:
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not allowed_file(name):
+                        continue
+                    if info.file_size > max_file_size:
+                        yield name, None, 'File too large'
+                        continue
+                    with archive.open(info) as member:
+                        content = member.read(max_file_size + 1)
+                    yield (name, None, 'File too large') if len(content) > max_file_size else (name, content, None)
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+                for member in archive:
+                    name = os.path.basename(member.name)
+                    if not member.isfile() or not allowed_file(name):
+                        continue
+                    if member.size > max_file_size:
+                        yield name, None, 'File too large'
+                        continue
+                    yield name, archive.extractfile(member).read(), None
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise BatchError(f"Could not read archive {filename}: {str(e)}")
+
+
+def write_archive(path, entries):
+    """Write (archive name, file path) entries to a zip file at path"""
+    used_names = set()
+    # Images are already compressed, so they are stored as-is
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for index, (name, file_path) in enumerate(entries):
+            if name in used_names:
+                name = f"{index + 1}_{name}"
+            used_names.add(name)
+            archive.write(file_path, arcname=name)
+
+
+def _init_worker():
+    # Workers import only the processing pipeline, not the app with its database
+    # setup and background threads. The face detectors are loaded once per worker
+    # process; every image the process handles afterwards reuses them.
+    from structured_logging import configure_logging
+    configure_logging()
+    import processing  # noqa: F401
+    if os.environ.get('WARMUP_DETECTORS', 'true') == 'true':
+        from detectors import warm_up_detectors
+        warm_up_detectors()
+
+
+def _start_executor():
+    # Spawned workers start clean instead of inheriting the parent's threads
+    executor = ProcessPoolExecutor(
+        max_workers=max(1, BATCH_WORKERS),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker
+    )
+    logging.info(f"Started batch process pool with {BATCH_WORKERS} workers")
+    return executor
+
+
+_executor = ProcessLocal(_start_executor)
+
+
+def get_batch_executor():
+    """Per-process pool of worker processes for batch processing"""
+    return _executor.get()
+
+
+def reset_batch_executor():
+    """Drop a broken process pool so the next batch starts a fresh one"""
+    executor = _executor.reset()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,101 @@
+"""Benchmark metadata removal: time and peak memory per megapixel
+
+Usage: python benchmarks/bench_metadata.py [--sizes 1,4,12] [--methods legacy,buffer,container] [--repeat 3]
+
+Each (method, size) case runs in a fresh interpreter through harness.py, on
+a JPEG with EXIF generated by fixtures.py.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import encode_fixture, make_image  # noqa: E402
+from harness import run_case, run_child  # noqa: E402
+
+
+def legacy_strip(data):
+    """The original getdata/putdata approach, for comparison"""
+    image = Image.open(io.BytesIO(data))
+    pixels = list(image.getdata())
+    clean = Image.new(image.mode, image.size)
+    clean.putdata(pixels)
+    buffer = io.BytesIO()
+    clean.save(buffer, 'JPEG', quality=95, optimize=True)
+    return buffer.getvalue()
+
+
+def buffer_strip(data):
+    """Decode, copy the pixel buffer without metadata and re-encode"""
+    from processing import remove_metadata
+    from encoding import encode_image, save_options
+    return encode_image(remove_metadata(io.BytesIO(data)), 'JPEG', save_options('JPEG'))[0]
+
+
+def container_strip(data):
+    """Drop metadata segments without decoding pixels"""
+    from metadata import strip_metadata
+    return strip_metadata(data, 'JPEG')
+
+
+METHODS = {
+    'legacy': legacy_strip,
+    'buffer': buffer_strip,
+    'container': container_strip,
+}
+
+
+def write_fixture(megapixels, path):
+    """Write a JPEG with EXIF of roughly the given size; returns its actual megapixels"""
+    img, _ = make_image(megapixels)
+    with open(path, 'wb') as fixture_file:
+        fixture_file.write(encode_fixture(img, 'jpg'))
+    return img.shape[0] * img.shape[1] / 1_000_000
+
+
+def setup_method(case):
+    """Read the fixture and return a function that strips its metadata with the case's method"""
+    with open(case['path'], 'rb') as fixture_file:
+        data = fixture_file.read()
+    if case['method'] != 'legacy':
+        # Import app (and OpenCV) before measuring the baseline
+        import app  # noqa: F401
+    strip = METHODS[case['method']]
+    return lambda: strip(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,4,12', help='comma-separated megapixel sizes')
+    parser.add_argument('--methods', default=','.join(METHODS), help='comma-separated methods')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--warmup', type=int, default=0, help='untimed runs per case')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(setup_method, json.loads(args.child), args.repeat, args.warmup)
+        return
+
+    print(f"{'method':<10} {'MP':>6} {'ms':>10} {'ms/MP':>8} {'peak MB':>9} {'MB/MP':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (float(s) for s in args.sizes.split(',')):
+            path = os.path.join(tmp, f'{size:g}mp.jpg')
+            megapixels = write_fixture(size, path)
+            for method in args.methods.split(','):
+                stats = run_case(__file__, {'method': method, 'path': path}, args.repeat, args.warmup, cwd=tmp)
+                # The fastest run, as the least disturbed by the rest of the machine
+                ms = min(stats['timings_ms'])
+                print(f"{method:<10} {megapixels:>6.1f} {ms:>10.1f} {ms / megapixels:>8.2f} "
+                      f"{stats['peak_mb']:>9.1f} {stats['peak_mb'] / megapixels:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Benchmark the image processing hot paths across image sizes, formats, face counts and blur strengths
+
+Usage: python benchmarks/bench_suite.py [--stages remove_metadata,upload] [--sizes 1,4,12]
+           [--formats jpg,png,webp] [--faces 1,8] [--strengths 50] [--repeat 10]
+           [--output results.json] [--baseline baseline.json] [--threshold 0.15]
+
+Each case runs in a fresh interpreter so the peak RSS it reports belongs to
+that case alone. Images are generated by fixtures.py, so runs are
+reproducible without sample files. Detection runs on a photo with real faces
+and also reports its recall against full-resolution detection. A results
+file saved with --output can be passed back as --baseline; cases whose
+median latency or peak memory grew by more than --threshold, or whose recall
+dropped, are flagged and the exit status is 1.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+import PIL
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import FIXTURE_FORMATS, encode_fixture, make_image, make_photo  # noqa: E402
+from harness import run_case, run_child  # noqa: E402
+
+# The options each stage is measured across; the rest stay at their defaults
+STAGE_DIMENSIONS = {
+    'remove_metadata': ('megapixels', 'format'),
+    'blur_coordinates': ('megapixels', 'faces', 'strength'),
+    'detect_and_blur': ('megapixels', 'strength'),
+    'upload': ('megapixels', 'format', 'faces'),
+}
+CASE_DEFAULTS = {'format': 'jpg', 'faces': 0, 'strength': 50}
+# Stages measured on fixtures.make_photo, whose faces the detectors find
+PHOTO_STAGES = ('detect_and_blur',)
+# Differences smaller than these are noise, whatever the relative change
+MIN_DELTA_MS = 2.0
+MIN_DELTA_MB = 5.0
+
+
+def read_fixture(case):
+    with open(case['path'], 'rb') as fixture_file:
+        return fixture_file.read()
+
+
+def setup_remove_metadata(case):
+    """Decode and copy the pixels without metadata, as uploads without blurring do"""
+    from processing import remove_metadata
+    data = read_fixture(case)
+    return lambda: remove_metadata(io.BytesIO(data))
+
+
+def setup_blur_coordinates(case):
+    """Blur client-supplied face boxes in an already decoded array"""
+    from processing import blur_faces_from_coordinates
+    from coordinates import face_boxes_from_coordinates
+    img = cv2.imread(case['path'])
+    face_boxes = face_boxes_from_coordinates(case['face_coordinates'])
+    # Blurring works in place, so every run gets a fresh copy of the fixture
+    return lambda: blur_faces_from_coordinates(img.copy(), face_boxes, case['strength'])
+
+
+def setup_detect_and_blur(case):
+    """Server-side detection plus blurring on an already decoded array
+
+    Also measures the recall of detection on the bounded-size copy against
+    detection at full resolution.
+    """
+    from processing import detect_and_blur_faces_opencv
+    from detection import detect_faces, detection_recall
+    from detectors import get_detector
+    get_detector().warm_up()
+    img = cv2.imread(case['path'])
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    recall = detection_recall(detect_faces(gray, max_edge=0), detect_faces(gray))
+    # Blurring works in place; detecting on already blurred faces would find none
+    return lambda: detect_and_blur_faces_opencv(img.copy(), case['strength']), {'recall': recall}
+
+
+def setup_upload(case):
+    """The whole /upload request: parse, decode, blur the client's boxes, encode and store"""
+    from app import app
+    data = read_fixture(case)
+    client = app.test_client()
+    form = {
+        'blur_strength': str(case['strength']),
+        'face_coordinates': json.dumps(case['face_coordinates']),
+        'detection_method': 'client',
+        'preview_mode': 'none',
+    }
+
+    def upload():
+        response = client.post('/upload', data={**form, 'file': (io.BytesIO(data), f"fixture.{case['format']}")},
+                               content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"Upload failed with {response.status_code}: {response.get_json()}")
+    return upload
+
+
+STAGES = {
+    'remove_metadata': setup_remove_metadata,
+    'blur_coordinates': setup_blur_coordinates,
+    'detect_and_blur': setup_detect_and_blur,
+    'upload': setup_upload,
+}
+
+
+def summarize(case, timings_ms, peak_mb, recall=None):
+    """Latency percentiles, throughput, peak memory and (for detection) recall of one case"""
+    timings = np.asarray(timings_ms)
+    mean_ms = float(timings.mean())
+    summary = {
+        'stage': case['stage'],
+        'megapixels': case['megapixels'],
+        'format': case['format'],
+        'faces': case['faces'],
+        'strength': case['strength'],
+        'repeat': len(timings),
+        'p50_ms': round(float(np.percentile(timings, 50)), 2),
+        'p90_ms': round(float(np.percentile(timings, 90)), 2),
+        'p99_ms': round(float(np.percentile(timings, 99)), 2),
+        'mean_ms': round(mean_ms, 2),
+        'images_per_s': round(1000 / mean_ms, 2),
+        'megapixels_per_s': round(case['megapixels'] * 1000 / mean_ms, 2),
+        'peak_mb': round(peak_mb, 1),
+    }
+    if recall is not None:
+        summary['recall'] = round(recall, 3)
+    return summary
+
+
+def case_key(case):
+    return f"{case['stage']}/{case['requested_mp']:g}mp/{case['format']}/{case['faces']}faces/s{case['strength']}"
+
+
+def iter_cases(args):
+    """Cases for the requested stages, each measured across its own dimensions"""
+    options = {
+        'megapixels': [float(s) for s in args.sizes.split(',')],
+        'format': args.formats.split(','),
+        'faces': [int(s) for s in args.faces.split(',')],
+        'strength': [int(s) for s in args.strengths.split(',')],
+    }
+    for stage in args.stages.split(','):
+        dimensions = STAGE_DIMENSIONS[stage]
+        for values in itertools.product(*(options[name] for name in dimensions)):
+            case = dict(CASE_DEFAULTS, stage=stage, **dict(zip(dimensions, values)))
+            if stage == 'blur_coordinates' and case['faces'] == 0:
+                # Nothing to blur
+                continue
+            case['requested_mp'] = case.pop('megapixels')
+            yield case
+
+
+def fixture_for(case, directory, fixtures):
+    """Write (or reuse) the fixture file for a case and fill in its path and faces"""
+    photo = case['stage'] in PHOTO_STAGES
+    key = (case['requested_mp'], case['format'], case['faces'], photo)
+    if key not in fixtures:
+        if photo:
+            img, faces = make_photo(case['requested_mp']), []
+            name = f"{case['requested_mp']:g}mp-photo.{case['format']}"
+        else:
+            img, faces = make_image(case['requested_mp'], case['faces'])
+            name = f"{case['requested_mp']:g}mp-{case['faces']}faces.{case['format']}"
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as fixture_file:
+            fixture_file.write(encode_fixture(img, case['format']))
+        fixtures[key] = (path, faces, img.shape[0] * img.shape[1] / 1_000_000)
+    path, faces, megapixels = fixtures[key]
+    return dict(case, path=path, face_coordinates=faces, megapixels=round(megapixels, 2))
+
+
+def compare(results, baseline, threshold):
+    """Change of each case against the baseline; returns {key: (p50 change, peak change, regressed)}
+
+    A case has regressed if it got slower or bigger beyond the threshold, or
+    if detection found fewer of the faces it found at full resolution.
+    """
+    changes = {}
+    for key, result in results.items():
+        base = baseline.get('cases', {}).get(key)
+        if base is None:
+            continue
+        latency_change = result['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+        slower = latency_change > threshold and result['p50_ms'] - base['p50_ms'] > MIN_DELTA_MS
+        bigger = (result['peak_mb'] > base['peak_mb'] * (1 + threshold) and
+                  result['peak_mb'] - base['peak_mb'] > MIN_DELTA_MB)
+        missed = result.get('recall', 1.0) < base.get('recall', 0.0)
+        changes[key] = (latency_change, result['peak_mb'] - base['peak_mb'], slower or bigger or missed)
+    return changes
+
+
+def environment():
+    """Versions and hardware the results were measured on"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated stages')
+    parser.add_argument('--sizes', default='1,4,12', help='comma-separated megapixel sizes')
+    parser.add_argument('--formats', default='jpg', help=f"comma-separated formats ({', '.join(FIXTURE_FORMATS)})")
+    parser.add_argument('--faces', default='1,8', help='comma-separated face counts')
+    parser.add_argument('--strengths', default='50', help='comma-separated blur strengths')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per case')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs per case')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='relative growth in median latency or peak memory flagged as a regression')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        case = json.loads(args.child)
+        run_child(STAGES[case['stage']], case, args.repeat, args.warmup)
+        return 0
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    print(f"{'case':<44} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'img/s':>7} {'MP/s':>7} {'peak MB':>8}"
+          f"{'  vs baseline' if baseline else ''}")
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = {}
+        for case in iter_cases(args):
+            case = fixture_for(case, tmp, fixtures)
+            # Run from the temporary directory so processed files land there
+            try:
+                measured = run_case(__file__, case, args.repeat, args.warmup, cwd=tmp)
+            except RuntimeError as e:
+                print(f"{case_key(case):<44} failed:\n{str(e)}")
+                continue
+            key = case_key(case)
+            results[key] = summarize(case, measured['timings_ms'], measured['peak_mb'], measured.get('recall'))
+            result = results[key]
+            line = (f"{key:<44} {result['p50_ms']:>9.1f} {result['p90_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                    f"{result['images_per_s']:>7.2f} {result['megapixels_per_s']:>7.1f} {result['peak_mb']:>8.1f}")
+            if 'recall' in result:
+                line += f"  recall {result['recall']:.2f}"
+            if baseline:
+                change = compare({key: result}, baseline, args.threshold).get(key)
+                if change is None:
+                    line += '  new'
+                else:
+                    line += f"  {change[0] * 100:+.1f}% {change[1]:+.1f}MB{'  REGRESSION' if change[2] else ''}"
+            print(line, flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'environment': environment(), 'args': {k: v for k, v in vars(args).items() if k != 'child'},
+                       'cases': results}, output_file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if baseline:
+        regressions = [key for key, change in compare(results, baseline, args.threshold).items() if change[2]]
+        if baseline.get('environment') != environment():
+            print("Note: baseline was measured on a different environment")
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Synthetic benchmark images, generated locally and reproducibly from a seed"""
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# PIL save format and options for each fixture format
+FIXTURE_FORMATS = {
+    'jpg': ('JPEG', {'quality': 90}),
+    'png': ('PNG', {'compress_level': 6}),
+    'webp': ('WEBP', {'quality': 90}),
+}
+
+# Face size as a fraction of the image's shorter side
+FACE_SCALE = 0.12
+
+# The original photo in the repo's detection screenshot, whose two real faces
+# the detectors do find: (path, rows, columns)
+PHOTO_SOURCE = (os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'screenshots', 'Face-Detection_Example.jpg'),
+                slice(36, 334), slice(32, 480))
+
+
+def fixture_size(megapixels):
+    """(width, height) of a 4:3 image of roughly the given size"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    return width, int(width * 3 / 4)
+
+
+def draw_faces(img, count, rng):
+    """Draw count face-like ellipses on a BGR array; returns their client-style coordinates"""
+    height, width = img.shape[:2]
+    size = max(16, int(min(width, height) * FACE_SCALE))
+    # Spread faces over a grid so they don't overlap
+    columns = max(1, int(np.ceil(np.sqrt(count * width / height))))
+    rows = max(1, int(np.ceil(count / columns)))
+    faces = []
+    for index in range(count):
+        cell_w, cell_h = width // columns, height // rows
+        w = h = min(size, cell_w, cell_h)
+        x = (index % columns) * cell_w + int(rng.integers(0, max(1, cell_w - w)))
+        y = (index // columns) * cell_h + int(rng.integers(0, max(1, cell_h - h)))
+        center = (x + w // 2, y + h // 2)
+        cv2.ellipse(img, center, (w * 2 // 5, h // 2), 0, 0, 360, (120, 160, 215), -1)
+        for eye_x in (x + w // 3, x + 2 * w // 3):
+            cv2.circle(img, (eye_x, y + h * 2 // 5), max(1, w // 14), (40, 40, 40), -1)
+        cv2.ellipse(img, (center[0], y + h * 3 // 4), (w // 6, h // 16), 0, 0, 180, (60, 60, 150), -1)
+        faces.append({'x': x, 'y': y, 'width': w, 'height': h})
+    return faces
+
+
+def make_image(megapixels, faces=0, seed=0):
+    """Photo-like BGR array of roughly the given size with face-like shapes
+
+    Smooth noise gives encoders and blurs realistic work; the faces are
+    shapes at known coordinates, not something the detectors will find.
+    Returns the array and the faces' coordinates.
+    """
+    width, height = fixture_size(megapixels)
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    # Fine grain, as in a camera image, so encoders can't shortcut flat areas
+    img = cv2.add(img, rng.integers(0, 12, img.shape, dtype=np.uint8))
+    return img, draw_faces(img, faces, rng)
+
+
+def make_photo(megapixels):
+    """BGR array of roughly the given size, scaled up from the photo with real faces
+
+    For measuring detection: unlike make_image's shapes, these faces are
+    found by the detectors. The photo's 3:2 aspect ratio is kept.
+    """
+    path, rows, columns = PHOTO_SOURCE
+    photo = cv2.imread(path)[rows, columns]
+    aspect = photo.shape[1] / photo.shape[0]
+    width = int((megapixels * 1_000_000 * aspect) ** 0.5)
+    return cv2.resize(photo, (width, int(width / aspect)), interpolation=cv2.INTER_CUBIC)
+
+
+def encode_fixture(img, fmt):
+    """Encode a BGR fixture with camera-style EXIF in one of FIXTURE_FORMATS"""
+    save_format, options = FIXTURE_FORMATS[fmt]
+    exif = Image.Exif()
+    exif[0x010F] = 'Benchmark'
+    exif[0x0110] = 'Camera'
+    exif[0x0131] = 'fixtures.py'
+    buffer = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).save(buffer, save_format, exif=exif, **options)
+    return buffer.getvalue()
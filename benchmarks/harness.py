@@ -0,0 +1,55 @@
+"""Run benchmark cases each in a fresh interpreter, so the peak RSS a case reports is its own"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+def child_env():
+    """Environment for measuring processing only: no warm-up at import, caching, sweeps, metrics files or database"""
+    env = dict(os.environ, WARMUP_DETECTORS='false', RESULT_CACHE_ENABLED='false', RETENTION_SWEEPER='false',
+               METRICS_DIR='')
+    env.pop('DATABASE_URL', None)
+    return env
+
+
+def run_child(setup, case, repeat, warmup):
+    """Run one case in this process and print its measurements as JSON
+
+    setup(case) prepares the case and returns the function to time, or a
+    (function, quality measurements) pair.
+    """
+    run = setup(case)
+    # Stages may also return quality measurements taken during setup
+    run, quality = run if isinstance(run, tuple) else (run, {})
+    # Memory held by imports, models and the fixture is not the stage's. Peak RSS
+    # only ever grows, so the baseline is taken before the warm-up runs.
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'timings_ms': timings, 'peak_mb': (peak_kb - baseline_kb) / 1024, **quality}))
+
+
+def run_case(script, case, repeat, warmup, cwd):
+    """Run a case through `script --child` in a fresh interpreter and return its measurements
+
+    The script must pass --child cases to run_child. Raises RuntimeError
+    with the child's last line of stderr if it fails.
+    """
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(script), '--repeat', str(repeat), '--warmup', str(warmup),
+         '--child', json.dumps(case)],
+        capture_output=True, text=True, cwd=cwd, env=child_env()
+    )
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"exit status {completed.returncode}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
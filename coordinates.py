@@ -0,0 +1,96 @@
+import os
+import json
+
+import numpy as np
+
+# Most face boxes a client may send with one image; larger payloads are rejected
+MAX_FACE_COORDINATES = int(os.environ.get('MAX_FACE_COORDINATES', 256))
+# JSON bytes allowed per box, enough for the frontend's boxes with their image
+# and display sizes; longer payloads are rejected before they are parsed
+COORDINATE_BYTES_PER_FACE = 512
+COORDINATE_FIELDS = ('x', 'y', 'width', 'height')
+# Coordinates are clamped to this before the integer conversion; any image is smaller
+MAX_COORDINATE = 2 ** 31 - 1
+
+
+class CoordinateError(Exception):
+    """Client face coordinates that are malformed or too many, reported to the client as a 400"""
+
+
+def empty_face_boxes():
+    """An (0, 4) box array"""
+    return np.empty((0, 4), dtype=np.int64)
+
+
+def face_boxes_from_coordinates(face_coordinates, max_faces=MAX_FACE_COORDINATES):
+    """Validate a list of {x, y, width, height} dicts and convert it to an (N, 4) int64 array
+
+    Other keys are ignored. Numbers are truncated to whole pixels, as
+    int() would. Raises CoordinateError for anything else.
+    """
+    if not isinstance(face_coordinates, list):
+        raise CoordinateError('face_coordinates must be a JSON list of boxes')
+    if len(face_coordinates) > max_faces:
+        raise CoordinateError(f'Too many face coordinates. Maximum is {max_faces} per image')
+    if not face_coordinates:
+        return empty_face_boxes()
+
+    rows = []
+    for i, face in enumerate(face_coordinates):
+        if not isinstance(face, dict):
+            raise CoordinateError(f'Face {i + 1} must be an object with x, y, width and height')
+        try:
+            rows.append([face[field] for field in COORDINATE_FIELDS])
+        except KeyError as e:
+            raise CoordinateError(f'Face {i + 1} is missing {e.args[0]}')
+    try:
+        # Strings are refused here too: only JSON numbers are valid coordinates
+        if any(isinstance(value, (str, bool)) or value is None for row in rows for value in row):
+            raise ValueError
+        boxes = np.array(rows, dtype=np.float64)
+    except (ValueError, TypeError):
+        raise CoordinateError('Face coordinates must be numbers')
+    if not np.isfinite(boxes).all():
+        raise CoordinateError('Face coordinates must be finite numbers')
+    if (boxes[:, 2:] <= 0).any():
+        raise CoordinateError('Face width and height must be positive')
+    return np.clip(boxes, -MAX_COORDINATE, MAX_COORDINATE).astype(np.int64)
+
+
+def parse_face_coordinates(payload, max_faces=MAX_FACE_COORDINATES):
+    """Parse the face_coordinates form field into an (N, 4) int64 array of x, y, width, height
+
+    An oversized payload is refused by its length alone, before any JSON is
+    parsed. An empty field means no boxes.
+    """
+    if payload is None or not payload.strip():
+        return empty_face_boxes()
+    if len(payload) > (max_faces + 1) * COORDINATE_BYTES_PER_FACE:
+        raise CoordinateError(f'Too many face coordinates. Maximum is {max_faces} per image')
+    try:
+        face_coordinates = json.loads(payload)
+    except json.JSONDecodeError:
+        raise CoordinateError('face_coordinates is not valid JSON')
+    return face_boxes_from_coordinates(face_coordinates, max_faces)
+
+
+def clip_face_boxes(boxes, img_shape):
+    """Clip (x, y, w, h) boxes to an image of img_shape (height, width, ...), keeping each at least 1px"""
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    height, width = img_shape[:2]
+    x = np.clip(boxes[:, 0], 0, width - 1)
+    y = np.clip(boxes[:, 1], 0, height - 1)
+    w = np.maximum(1, np.minimum(boxes[:, 2], width - x))
+    h = np.maximum(1, np.minimum(boxes[:, 3], height - y))
+    return np.stack((x, y, w, h), axis=1)
+
+
+def pad_face_boxes(boxes, width, height):
+    """Grow (x, y, w, h) face boxes by a margin for better coverage, clipped to the image"""
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    padding = np.maximum(5, np.minimum(boxes[:, 2], boxes[:, 3]) // 10)
+    x = np.maximum(0, boxes[:, 0] - padding)
+    y = np.maximum(0, boxes[:, 1] - padding)
+    w = np.minimum(width - x, boxes[:, 2] + 2 * padding)
+    h = np.minimum(height - y, boxes[:, 3] + 2 * padding)
+    return np.stack((x, y, w, h), axis=1)
@@ -0,0 +1,341 @@
+import os
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from process_local import ProcessLocal
+
+# Haar cascades used for server-side face detection, in the order they are run
+CASCADE_FILES = {
+    'default': 'haarcascade_frontalface_default.xml',
+    'alt': 'haarcascade_frontalface_alt.xml',
+    'alt2': 'haarcascade_frontalface_alt2.xml',
+}
+
+# Detection runs on a copy whose longest edge is at most this many pixels
+# (0 disables downscaling). Boxes are mapped back to full resolution.
+DETECTION_MAX_EDGE = int(os.environ.get('DETECTION_MAX_EDGE', 1280))
+# Re-check small boxes found on the downscaled copy at higher resolution
+DETECTION_REFINE = os.environ.get('DETECTION_REFINE', 'false') == 'true'
+
+# Threads per worker process used to run cascades (and tiles) concurrently;
+# 0 or 1 runs them sequentially on the request thread
+DETECTION_THREADS = int(os.environ.get('DETECTION_THREADS', min(3, os.cpu_count() or 1)))
+# Split detection images larger than this edge into overlapping tiles (0 disables)
+DETECTION_TILE_SIZE = int(os.environ.get('DETECTION_TILE_SIZE', 0))
+# Fraction of a tile shared with its neighbours so faces on a seam are seen whole
+TILE_OVERLAP = 0.25
+
+# detectMultiScale parameters, in full-resolution pixels
+SCALE_FACTOR = 1.2
+MIN_NEIGHBORS = 8
+MIN_FACE_SIZE = 50
+# Smallest window the cascades were trained on
+CASCADE_WINDOW = 24
+# Boxes smaller than this on the detection copy are refined when enabled
+REFINE_BELOW = 2 * MIN_FACE_SIZE
+
+
+class CascadeRegistry:
+    """Load Haar cascades once per worker and share them across requests"""
+
+    def __init__(self, cascade_files, cascade_dir=None):
+        self.cascade_files = dict(cascade_files)
+        self.cascade_dir = cascade_dir
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Idle classifiers per cascade. A CascadeClassifier keeps per-call
+        # state, so each thread checks one out instead of sharing it.
+        self._pools = {}
+        self._errors = {}
+
+    def _cascade_path(self, name):
+        cascade_dir = self.cascade_dir or cv2.data.haarcascades
+        return cascade_dir + self.cascade_files[name]
+
+    def _create(self, name):
+        classifier = cv2.CascadeClassifier(self._cascade_path(name))
+        if classifier.empty():
+            raise ValueError(f"Could not load cascade {self._cascade_path(name)}")
+        return classifier
+
+    def load(self):
+        """Load and validate every cascade (safe to call repeatedly)"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for name in self.cascade_files:
+                try:
+                    start = time.perf_counter()
+                    pool = queue.SimpleQueue()
+                    pool.put(self._create(name))
+                    self._pools[name] = pool
+                    logging.info(f"Loaded cascade '{name}' in {(time.perf_counter() - start) * 1000:.1f}ms")
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    logging.warning(f"Cascade '{name}' unavailable: {str(e)}")
+            self._loaded = True
+
+    def available(self):
+        """Names of the cascades that loaded successfully, in run order"""
+        self.load()
+        return [name for name in self.cascade_files if name in self._pools]
+
+    def status(self):
+        """Availability of every configured cascade"""
+        self.load()
+        return {
+            name: {'available': name in self._pools, 'error': self._errors.get(name)}
+            for name in self.cascade_files
+        }
+
+    @contextmanager
+    def acquire(self, name):
+        """Borrow a classifier for the duration of one detection call"""
+        self.load()
+        pool = self._pools.get(name)
+        if pool is None:
+            raise KeyError(f"Cascade '{name}' is not available")
+        try:
+            classifier = pool.get_nowait()
+        except queue.Empty:
+            # Another thread holds the cached instance; load an extra copy
+            # which is returned to the pool afterwards for reuse
+            classifier = self._create(name)
+        try:
+            yield classifier
+        finally:
+            pool.put(classifier)
+
+    def warm_up(self):
+        """Load all cascades and run one tiny detection through each"""
+        start = time.perf_counter()
+        blank = np.zeros((64, 64), dtype=np.uint8)
+        for name in self.available():
+            with self.acquire(name) as classifier:
+                classifier.detectMultiScale(blank, scaleFactor=1.2, minNeighbors=8)
+        logging.info(f"Face detectors warmed up in {(time.perf_counter() - start) * 1000:.1f}ms: {self.available()}")
+
+
+cascade_registry = CascadeRegistry(CASCADE_FILES)
+
+
+def downscale_for_detection(gray, max_edge):
+    """Shrink a grayscale image so its longest edge fits max_edge; returns (image, scale)"""
+    height, width = gray.shape[:2]
+    longest = max(height, width)
+    if not max_edge or longest <= max_edge:
+        return gray, 1.0
+    scale = max_edge / longest
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), scale
+
+
+_executor = ProcessLocal(
+    lambda: ThreadPoolExecutor(max_workers=DETECTION_THREADS, thread_name_prefix='face-detect'))
+
+
+def get_detection_executor():
+    """Per-process thread pool for detection, or None when running sequentially"""
+    if DETECTION_THREADS <= 1:
+        return None
+    return _executor.get()
+
+
+def iter_tiles(height, width, tile_size, overlap=TILE_OVERLAP):
+    """Yield (x0, y0, x1, y1) windows of at most tile_size covering the image with overlap"""
+    if not tile_size or (height <= tile_size and width <= tile_size):
+        yield (0, 0, width, height)
+        return
+    step = max(1, int(tile_size * (1 - overlap)))
+    for y0 in range(0, max(1, height - tile_size + step), step):
+        for x0 in range(0, max(1, width - tile_size + step), step):
+            # Shift the last row/column back so every tile is full size
+            x0 = max(0, min(x0, width - tile_size))
+            y0 = max(0, min(y0, height - tile_size))
+            yield (x0, y0, min(width, x0 + tile_size), min(height, y0 + tile_size))
+
+
+def _run_cascade(cascade_name, gray, min_size, offset):
+    try:
+        with cascade_registry.acquire(cascade_name) as face_cascade:
+            # Detect faces with stricter parameters to reduce false positives
+            faces = face_cascade.detectMultiScale(
+                gray,
+                scaleFactor=SCALE_FACTOR,
+                minNeighbors=MIN_NEIGHBORS,
+                minSize=(min_size, min_size),
+                flags=cv2.CASCADE_SCALE_IMAGE
+            )
+        return [(int(x) + offset[0], int(y) + offset[1], int(w), int(h)) for (x, y, w, h) in faces]
+    except Exception as e:
+        logging.warning(f"Error with cascade {cascade_name}: {str(e)}")
+        return []
+
+
+def run_cascades(gray, min_size=MIN_FACE_SIZE, parallel=True, tile_size=None):
+    """Run every available cascade over gray (optionally per tile) and return the raw boxes"""
+    if tile_size is None:
+        tile_size = DETECTION_TILE_SIZE
+    min_size = max(CASCADE_WINDOW, int(round(min_size)))
+
+    jobs = []
+    for (x0, y0, x1, y1) in iter_tiles(gray.shape[0], gray.shape[1], tile_size):
+        for cascade_name in cascade_registry.available():
+            jobs.append((cascade_name, gray[y0:y1, x0:x1], min_size, (x0, y0)))
+
+    # OpenCV releases the GIL inside detectMultiScale, so the jobs overlap
+    executor = get_detection_executor() if parallel else None
+    if executor is not None and len(jobs) > 1:
+        results = executor.map(lambda job: _run_cascade(*job), jobs)
+    else:
+        results = (_run_cascade(*job) for job in jobs)
+
+    boxes = []
+    for found in results:
+        boxes.extend(found)
+    return boxes
+
+
+def box_iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of two (N, 4) / (M, 4) arrays of x, y, width, height boxes"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+    overlap_x = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    overlap_y = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    overlap_area = overlap_x * overlap_y
+    union_area = (a[:, 2] * a[:, 3])[:, None] + b[:, 2] * b[:, 3] - overlap_area
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union_area > 0, overlap_area / union_area, 0.0)
+
+
+def non_max_suppression(boxes, scores=None, iou_threshold=0.3):
+    """Indices of the boxes kept after greedy non-maximum suppression
+
+    Boxes are ranked by score (box area when no scores are given), with ties
+    broken by position, so the result does not depend on input order.
+    """
+    return np.asarray([group[0] for group in suppression_groups(boxes, scores, iou_threshold)], dtype=np.intp)
+
+
+def suppression_groups(boxes, scores=None, iou_threshold=0.3):
+    """Greedy non-maximum suppression that also reports what each kept box suppressed
+
+    Returns one index array per kept box, in rank order: the kept box
+    first, then the boxes it suppressed. Every box is in exactly one group.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return []
+    if scores is None:
+        scores = boxes[:, 2] * boxes[:, 3]
+    scores = np.asarray(scores, dtype=np.float64)
+
+    # lexsort uses the last key as the primary one: score descending, then x, y, w, h
+    order = np.lexsort((boxes[:, 3], boxes[:, 2], boxes[:, 1], boxes[:, 0], -scores))
+    iou = box_iou_matrix(boxes[order], boxes[order])
+
+    suppressed = np.zeros(len(order), dtype=bool)
+    groups = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        members = (iou[i] > iou_threshold) & ~suppressed
+        members[i] = False
+        groups.append(np.concatenate(([order[i]], order[members])).astype(np.intp))
+        suppressed |= members
+        suppressed[i] = True
+    return groups
+
+
+def filter_faces(boxes, iou_threshold=0.3):
+    """Drop very small or unusually shaped boxes and merge overlapping ones"""
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    w, h = boxes[:, 2], boxes[:, 3]
+    # Basic quality filtering - skip very small or unusually shaped faces
+    valid = (w >= 40) & (h >= 40) & (w <= 2 * h) & (h <= 2 * w)
+    boxes = boxes[valid]
+    # Where faces overlap, keep the larger one
+    kept = boxes[non_max_suppression(boxes, iou_threshold=iou_threshold)]
+    # Return faces top-to-bottom, left-to-right
+    kept = kept[np.lexsort((kept[:, 3], kept[:, 2], kept[:, 0], kept[:, 1]))]
+    return [tuple(int(v) for v in box) for box in kept]
+
+
+def _scale_box(box, scale):
+    x, y, w, h = box
+    return (int(round(x / scale)), int(round(y / scale)),
+            int(round(w / scale)), int(round(h / scale)))
+
+
+def refine_box(gray, box, max_edge):
+    """Re-detect inside a box's neighbourhood at (up to) full resolution
+
+    Returns the boxes found there in full-resolution coordinates, or the
+    original box if nothing is confirmed, so refinement never loses a face.
+    """
+    x, y, w, h = box
+    margin = max(w, h) // 2
+    x0, y0 = max(0, x - margin), max(0, y - margin)
+    x1, y1 = min(gray.shape[1], x + w + margin), min(gray.shape[0], y + h + margin)
+    crop, scale = downscale_for_detection(gray[y0:y1, x0:x1], max_edge)
+    found = run_cascades(crop, MIN_FACE_SIZE * scale)
+    if not found:
+        return [box]
+    refined = []
+    for face in found:
+        fx, fy, fw, fh = _scale_box(face, scale)
+        refined.append((fx + x0, fy + y0, fw, fh))
+    return refined
+
+
+def detect_faces(gray, max_edge=None, refine=None, parallel=True, tile_size=None, source_scale=1.0):
+    """Detect faces on a bounded-size copy of gray; boxes are in full-resolution pixels
+
+    source_scale is gray's size relative to the full image when gray is
+    already a reduced copy, so face size limits and boxes stay in full-image
+    pixels. Refinement needs the full image and is skipped for reduced copies.
+    """
+    if max_edge is None:
+        max_edge = DETECTION_MAX_EDGE
+    if refine is None:
+        refine = DETECTION_REFINE
+
+    small, downscale = downscale_for_detection(gray, max_edge)
+    scale = downscale * source_scale
+    raw_boxes = run_cascades(small, MIN_FACE_SIZE * scale, parallel=parallel, tile_size=tile_size)
+
+    boxes = []
+    for box in raw_boxes:
+        full_box = _scale_box(box, scale)
+        if refine and source_scale == 1.0 and scale < 1.0 and min(box[2], box[3]) < REFINE_BELOW:
+            boxes.extend(refine_box(gray, full_box, max(max_edge // 2, REFINE_BELOW * 4)))
+        else:
+            boxes.append(full_box)
+
+    if downscale < 1.0:
+        logging.debug("Detection ran at %dx%d (scale %.3f) for %dx%d image",
+                      small.shape[1], small.shape[0], scale, gray.shape[1], gray.shape[0])
+    return filter_faces(boxes)
+
+
+def detection_recall(reference_faces, faces, iou_threshold=0.3):
+    """Fraction of reference boxes matched by a box in faces (for comparing detection modes)"""
+    if not reference_faces:
+        return 1.0
+    if not faces:
+        return 0.0
+    iou = box_iou_matrix(reference_faces, faces)
+    return float(np.mean(iou.max(axis=1) >= iou_threshold))
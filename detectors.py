@@ -0,0 +1,245 @@
+import os
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from detection import (DETECTION_MAX_EDGE, DETECTION_REFINE, DETECTION_TILE_SIZE, cascade_registry, detect_faces,
+                       downscale_for_detection, iter_tiles, non_max_suppression)
+
+# Backend used by the 'server' and 'hybrid' detection methods and the client fallback
+SERVER_DETECTOR = os.environ.get('SERVER_DETECTOR', 'haar')
+
+# OpenCV's ResNet-10 SSD face detector (res10_300x300_ssd_iter_140000 from the
+# OpenCV samples); it is not bundled, so the dnn backend is off until both files exist
+DNN_MODEL = os.environ.get('DNN_MODEL', 'face_models/res10_300x300_ssd_iter_140000_fp16.caffemodel')
+DNN_CONFIG = os.environ.get('DNN_CONFIG', 'face_models/deploy.prototxt')
+# Edge of the square each tile is resized to before inference
+DNN_INPUT_SIZE = int(os.environ.get('DNN_INPUT_SIZE', 300))
+# Detections scoring below this are dropped
+DNN_CONFIDENCE = float(os.environ.get('DNN_CONFIDENCE', 0.5))
+# The network sees small faces poorly once the whole image is squeezed into its
+# input, so larger detection images are also covered by overlapping tiles
+DNN_TILE_SIZE = int(os.environ.get('DNN_TILE_SIZE', 640))
+# Tiles run through the network together in batches of at most this many
+DNN_BATCH_SIZE = int(os.environ.get('DNN_BATCH_SIZE', 8))
+# Per-channel means (BGR) the model was trained with
+DNN_MEAN = (104.0, 177.0, 123.0)
+DNN_NMS_THRESHOLD = 0.3
+
+
+class FaceDetector(ABC):
+    """Interface of a server-side face detector backend
+
+    detect() takes a BGR or grayscale array, optionally a copy reduced by
+    scale, and returns (box, score) pairs with (x, y, w, h) boxes in
+    full-image pixels; score is None for backends that don't produce one.
+    """
+
+    name = None
+    # Whether detect() makes use of colour; grayscale input is enough otherwise
+    uses_color = False
+
+    @abstractmethod
+    def available(self):
+        """Whether the backend can be used on this server"""
+
+    @abstractmethod
+    def status(self):
+        """Availability and load state, for the stats page"""
+
+    @abstractmethod
+    def settings(self):
+        """Configuration that changes what the detector finds, for cache keys"""
+
+    @abstractmethod
+    def warm_up(self):
+        """Load the backend's models ahead of the first request"""
+
+    @abstractmethod
+    def detect(self, img, tile_size=None, scale=1.0):
+        """(box, score) pairs for the faces in img"""
+
+
+class HaarDetector(FaceDetector):
+    """The Haar cascade trio from detection.py"""
+
+    name = 'haar'
+
+    def available(self):
+        return bool(cascade_registry.available())
+
+    def status(self):
+        return {'available': self.available(), 'cascades': cascade_registry.status()}
+
+    def settings(self):
+        return [self.name, DETECTION_MAX_EDGE, DETECTION_REFINE, DETECTION_TILE_SIZE]
+
+    def warm_up(self):
+        cascade_registry.warm_up()
+
+    def detect(self, img, tile_size=None, scale=1.0):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return [(box, None) for box in detect_faces(gray, tile_size=tile_size, source_scale=scale)]
+
+
+class DnnDetector(FaceDetector):
+    """SSD face detector run on the CPU through cv2.dnn, with batched tile inference
+
+    The network is loaded once per worker. A cv2.dnn.Net can't run two
+    forward passes at once, so each thread checks one out of a pool.
+    """
+
+    name = 'dnn'
+    uses_color = True
+
+    def __init__(self, model_path, config_path, input_size=DNN_INPUT_SIZE, confidence=DNN_CONFIDENCE,
+                 tile_size=DNN_TILE_SIZE, batch_size=DNN_BATCH_SIZE):
+        self.model_path = model_path
+        self.config_path = config_path
+        self.input_size = input_size
+        self.confidence = confidence
+        self.tile_size = tile_size
+        self.batch_size = max(1, batch_size)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._pool = None
+        self._error = None
+
+    def _create(self):
+        net = cv2.dnn.readNetFromCaffe(self.config_path, self.model_path)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        return net
+
+    def load(self):
+        """Load the network if its files exist (safe to call repeatedly)"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                for path in (self.model_path, self.config_path):
+                    if not os.path.isfile(path):
+                        raise FileNotFoundError(f"{path} not found")
+                start = time.perf_counter()
+                self._pool = queue.SimpleQueue()
+                self._pool.put(self._create())
+                logging.info(f"Loaded DNN face detector in {(time.perf_counter() - start) * 1000:.1f}ms")
+            except Exception as e:
+                self._pool = None
+                self._error = str(e)
+                logging.warning(f"DNN face detector unavailable: {str(e)}")
+            self._loaded = True
+
+    def available(self):
+        self.load()
+        return self._pool is not None
+
+    def status(self):
+        return {'available': self.available(), 'error': self._error, 'model': self.model_path,
+                'input_size': self.input_size, 'confidence': self.confidence}
+
+    def settings(self):
+        return [self.name, os.path.basename(self.model_path), DETECTION_MAX_EDGE, self.input_size,
+                self.confidence, self.tile_size]
+
+    @contextmanager
+    def acquire(self):
+        """Borrow a network for the duration of one forward pass"""
+        if not self.available():
+            raise RuntimeError(f"DNN face detector is not available: {self._error}")
+        try:
+            net = self._pool.get_nowait()
+        except queue.Empty:
+            net = self._create()
+        try:
+            yield net
+        finally:
+            self._pool.put(net)
+
+    def warm_up(self):
+        if self.available():
+            start = time.perf_counter()
+            self.detect(np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8))
+            logging.info(f"DNN face detector warmed up in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def _infer(self, crops):
+        """Raw (crop index, score, x0, y0, x1, y1) rows for a batch of crops, corners as fractions"""
+        size = (self.input_size, self.input_size)
+        blob = cv2.dnn.blobFromImages(crops, 1.0, size, DNN_MEAN, swapRB=False, crop=False)
+        with self.acquire() as net:
+            net.setInput(blob)
+            # DetectionOutput: (1, 1, N, 7) rows of [image id, label, score, x0, y0, x1, y1]
+            rows = net.forward().reshape(-1, 7)
+        rows = rows[rows[:, 2] >= self.confidence]
+        return rows[:, [0, 2, 3, 4, 5, 6]]
+
+    def detect(self, img, tile_size=None, scale=1.0):
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        small, downscale = downscale_for_detection(img, DETECTION_MAX_EDGE)
+        scale *= downscale
+        height, width = small.shape[:2]
+        if tile_size is None:
+            tile_size = self.tile_size
+
+        # The whole image finds large faces; tiles find the small ones
+        windows = [(0, 0, width, height)]
+        if tile_size and max(height, width) > tile_size:
+            windows.extend(iter_tiles(height, width, tile_size))
+
+        boxes = []
+        scores = []
+        for start in range(0, len(windows), self.batch_size):
+            batch = windows[start:start + self.batch_size]
+            crops = [small[y0:y1, x0:x1] for (x0, y0, x1, y1) in batch]
+            for index, score, fx0, fy0, fx1, fy1 in self._infer(crops):
+                x0, y0, x1, y1 = batch[int(index)]
+                left = x0 + np.clip(fx0, 0, 1) * (x1 - x0)
+                top = y0 + np.clip(fy0, 0, 1) * (y1 - y0)
+                right = x0 + np.clip(fx1, 0, 1) * (x1 - x0)
+                bottom = y0 + np.clip(fy1, 0, 1) * (y1 - y0)
+                if right - left >= 1 and bottom - top >= 1:
+                    boxes.append((left / scale, top / scale, (right - left) / scale, (bottom - top) / scale))
+                    scores.append(float(score))
+
+        # The same face is found by the whole-image pass and overlapping tiles; keep the best scoring box
+        keep = non_max_suppression(boxes, scores, DNN_NMS_THRESHOLD) if boxes else []
+        found = [(tuple(int(round(v)) for v in boxes[i]), round(scores[i], 3)) for i in keep]
+        if downscale < 1.0:
+            logging.debug("DNN detection ran at %dx%d (scale %.3f) in %d windows", width, height, scale, len(windows))
+        return sorted(found, key=lambda face: (face[0][1], face[0][0]))
+
+
+DETECTORS = {
+    'haar': HaarDetector(),
+    'dnn': DnnDetector(DNN_MODEL, DNN_CONFIG),
+}
+
+
+def get_detector(name=None):
+    """Detector backend by name; the configured server default when name is None
+
+    Falls back to Haar cascades if the default backend can't be loaded.
+    Raises KeyError for unknown names.
+    """
+    detector = DETECTORS[name or SERVER_DETECTOR]
+    if name is None and not detector.available():
+        detector = DETECTORS['haar']
+    return detector
+
+
+def warm_up_detectors():
+    """Startup hook: load face detectors before the first request arrives"""
+    for detector in DETECTORS.values():
+        try:
+            detector.warm_up()
+        except Exception as e:
+            logging.error(f"{detector.name} detector warm-up failed: {str(e)}")
@@ -0,0 +1,82 @@
+import os
+import io
+import time
+
+from metrics import stage
+
+# Encoder preset used when a request doesn't choose one
+ENCODER_PRESET = os.environ.get('ENCODER_PRESET', 'balanced')
+
+# PIL save format for each allowed extension
+OUTPUT_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+# Extension given to files converted to each format
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+# PIL save() options for each preset and format. Timings and sizes for a 6MP photo:
+#   fast      JPEG 22ms 1.32MB, PNG 0.6s 5.1MB, WebP 0.3s 0.96MB
+#   balanced  JPEG 56ms 1.14MB, PNG 1.5s 4.6MB, WebP 0.9s 0.93MB
+#   small     JPEG 0.1s 0.80MB, PNG 4.4s 4.5MB, WebP 1.2s 0.41MB
+ENCODER_PRESETS = {
+    'fast': {
+        'JPEG': {'quality': 95},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'quality': 95, 'method': 0},
+    },
+    'balanced': {
+        'JPEG': {'quality': 95, 'optimize': True},
+        # optimize=True is zlib level 9 plus filter search: 2.6x slower for 1% smaller files
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 95, 'method': 4},
+    },
+    'small': {
+        'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'quality': 80, 'method': 6},
+    },
+}
+
+# Lossless WebP reads quality as compression effort rather than fidelity
+WEBP_LOSSLESS_EFFORT = {'fast': 0, 'balanced': 50, 'small': 80}
+
+# Per-request overrides and the format each one applies to
+ENCODER_OVERRIDES = {'progressive': 'JPEG', 'compress_level': 'PNG', 'lossless': 'WEBP'}
+
+
+def output_format_for(filename, default='PNG'):
+    """PIL save format matching filename's extension"""
+    return OUTPUT_FORMATS.get(filename.rsplit('.', 1)[-1].lower(), default)
+
+
+def converted_filename(filename, output_format):
+    """filename with its extension changed to suit output_format, if it doesn't already"""
+    if output_format_for(filename, None) == output_format:
+        return filename
+    return f"{filename.rsplit('.', 1)[0]}.{FORMAT_EXTENSIONS[output_format]}"
+
+
+def save_options(output_format, preset=ENCODER_PRESET, overrides=None):
+    """PIL save() options for a format under a preset, with per-request overrides applied"""
+    options = dict(ENCODER_PRESETS[preset][output_format])
+    for key, value in (overrides or {}).items():
+        if ENCODER_OVERRIDES.get(key) == output_format:
+            options[key] = value
+    if output_format == 'PNG' and 'compress_level' in (overrides or {}):
+        # optimize would force level 9 regardless of the level asked for
+        options.pop('optimize', None)
+    if output_format == 'WEBP' and options.get('lossless'):
+        options['quality'] = WEBP_LOSSLESS_EFFORT[preset]
+    return options
+
+
+def encode_image(image, output_format, options):
+    """Encode a PIL image; returns the bytes and the milliseconds spent encoding"""
+    if output_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    elif output_format != 'JPEG' and image.mode == 'CMYK':
+        image = image.convert('RGB')
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    with stage('encode'):
+        image.save(buffer, output_format, **options)
+    return buffer.getvalue(), round((time.perf_counter() - start) * 1000, 1)
@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from process_local import ProcessLocal
+from retention import RETENTION_MAX_BYTES, FileStore
+
+# Background processing configuration
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+# Queued plus running jobs allowed before new submissions are rejected
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 32))
+# Seconds a finished job's result is kept for polling
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 600))
+# Finished jobs kept for polling; past this the oldest are dropped before their TTL
+JOB_MAX_FINISHED = int(os.environ.get('JOB_MAX_FINISHED', 256))
+# Job records are files, so any worker process can answer polls for a job another one accepted
+JOB_FOLDER = 'jobs'
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+
+class Job:
+    """A unit of background work and its outcome"""
+
+    def __init__(self, job_id=None, status='queued', submitted_at=None, started_at=None, finished_at=None,
+                 result=None, error=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.status = status
+        self.submitted_at = submitted_at or time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.result = result
+        self.error = error
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        """Job status and timings for the status endpoint"""
+        now = time.time()
+        started = self.started_at or now
+        finished = self.finished_at or now
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'queued_ms': int((started - self.submitted_at) * 1000),
+            'run_ms': int((finished - started) * 1000) if self.started_at else 0,
+            'total_ms': int((finished - self.submitted_at) * 1000),
+            'error': self.error,
+        }
+
+    def to_record(self):
+        """Everything needed to rebuild the job in another process"""
+        return {'job_id': self.id, 'status': self.status, 'submitted_at': self.submitted_at,
+                'started_at': self.started_at, 'finished_at': self.finished_at,
+                'result': self.result, 'error': self.error}
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild a job from to_record()"""
+        return cls(**record)
+
+
+class JobQueue:
+    """Bounded queue of jobs run on a per-process thread pool
+
+    OpenCV and Pillow release the GIL while working on pixels, so threads
+    spread jobs across cores without re-importing the app in each worker.
+    Each job's state is written to the store whenever it changes, so polls
+    can be answered by any worker process; the retention sweeper deletes
+    records older than the result TTL.
+    """
+
+    def __init__(self, workers, max_pending, store, max_finished):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.store = store
+        self.result_ttl = store.ttl
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Jobs this process finished, oldest first, so it can drop records past max_finished
+        self._finished = deque()
+        self._executor = ProcessLocal(
+            lambda: ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job'))
+
+    @staticmethod
+    def _filename(job_id):
+        return f"{job_id}.json"
+
+    def _save(self, job):
+        with self.store.writing(self._filename(job.id)) as path:
+            with open(path, 'w') as record_file:
+                json.dump(job.to_record(), record_file)
+
+    def _remove(self, job_id):
+        try:
+            os.remove(self.store.path_for(self._filename(job_id)))
+        except FileNotFoundError:
+            pass
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return its Job, or raise QueueFullError"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"{self._pending} jobs already pending")
+            self._pending += 1
+            executor = self._executor.get()
+        job = Job()
+        try:
+            self._save(job)
+            executor.submit(self._run, job, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.started_at = time.time()
+        job.status = 'running'
+        try:
+            self._save(job)
+            job.result = fn(*args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            logging.error(f"Job {job.id} failed: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            try:
+                self._save(job)
+            except Exception as e:
+                logging.error(f"Could not save job {job.id}: {str(e)}")
+            with self._lock:
+                self._pending -= 1
+                self._finished.append(job.id)
+                dropped = [self._finished.popleft() for _ in range(len(self._finished) - self.max_finished)]
+            for job_id in dropped:
+                self._remove(job_id)
+            logging.debug("Job %s %s in %.0fms after %.0fms queued", job.id, job.status,
+                          (job.finished_at - job.started_at) * 1000, (job.started_at - job.submitted_at) * 1000)
+
+    def get(self, job_id):
+        """The job with this id, accepted by any worker process, or None if unknown or expired"""
+        relative = self.store.find(self._filename(job_id))
+        if relative is None:
+            return None
+        try:
+            with open(os.path.join(self.store.directory, relative)) as record_file:
+                job = Job.from_record(json.load(record_file))
+        except (FileNotFoundError, ValueError):
+            # Swept, or dropped past max_finished, since it was found
+            return None
+        # Records wait for the next sweep after expiring
+        if job.done and job.finished_at < time.time() - self.result_ttl:
+            return None
+        return job
+
+    def stats(self):
+        """Number of this process's pending jobs and of finished jobs it keeps records for"""
+        with self._lock:
+            return {'pending': self._pending, 'tracked': len(self._finished), 'capacity': self.max_pending}
+
+
+job_store = FileStore(JOB_FOLDER, JOB_RESULT_TTL, RETENTION_MAX_BYTES)
+job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_SIZE, job_store, JOB_MAX_FINISHED)
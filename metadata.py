@@ -0,0 +1,142 @@
+import re
+import struct
+
+# JPEG APPn segments kept when stripping: APP0 (JFIF header) and APP14
+# (Adobe colour transform, needed to decode CMYK/YCCK files correctly).
+# Everything else - EXIF/XMP (APP1), ICC (APP2), IPTC (APP13), comments - goes.
+JPEG_KEEP_APP_MARKERS = {0xE0, 0xEE}
+
+# PNG chunks needed to render the image; text, time, EXIF and ICC chunks are dropped
+PNG_KEEP_CHUNKS = {
+    b'IHDR', b'PLTE', b'IDAT', b'IEND', b'tRNS', b'gAMA', b'cHRM', b'sRGB',
+    b'sBIT', b'bKGD', b'pHYs', b'acTL', b'fcTL', b'fdAT',
+}
+
+# WebP chunks carrying metadata, and the VP8X flags announcing them
+WEBP_METADATA_CHUNKS = {b'EXIF', b'XMP ', b'ICCP'}
+WEBP_METADATA_FLAGS = 0x20 | 0x08 | 0x04
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The first marker after entropy-coded data: 0xFF not followed by a stuffed
+# zero, a restart marker (RST0-7) or another 0xFF fill byte
+JPEG_SCAN_END = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+
+
+def strip_jpeg(data):
+    """Remove metadata segments from a JPEG without decoding it
+
+    Anything after the EOI marker (motion-photo video, an appended JPEG with
+    its own EXIF, trailers) is dropped as well.
+    """
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("Not a JPEG file")
+    out = [b'\xff\xd8']
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ValueError(f"Corrupt JPEG marker at offset {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+            continue
+        if marker == 0xD9:
+            # End of image; whatever follows is not part of it
+            out.append(data[pos:pos + 2])
+            return b''.join(out)
+        if 0xD0 <= marker <= 0xD8 or marker == 0x01:
+            # Markers without a length field
+            out.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        if pos + 4 > len(data):
+            raise ValueError("Truncated JPEG segment")
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        end = pos + 2 + length
+        if length < 2 or end > len(data):
+            raise ValueError("Truncated JPEG segment")
+        is_app = 0xE0 <= marker <= 0xEF
+        if (is_app and marker not in JPEG_KEEP_APP_MARKERS) or marker == 0xFE:
+            pos = end
+            continue
+        out.append(data[pos:end])
+        pos = end
+        if marker == 0xDA:
+            # Start of scan: copy the entropy-coded data up to the next marker
+            scan_end = JPEG_SCAN_END.search(data, pos)
+            if scan_end is None:
+                raise ValueError("JPEG scan has no end marker")
+            out.append(data[pos:scan_end.start()])
+            pos = scan_end.start()
+    raise ValueError("JPEG has no EOI marker")
+
+
+def strip_png(data):
+    """Remove metadata chunks from a PNG without decoding it"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    out = [PNG_SIGNATURE]
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        if pos + 8 > len(data):
+            raise ValueError("Truncated PNG chunk")
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        end = pos + 12 + length
+        if end > len(data):
+            raise ValueError("Truncated PNG chunk")
+        if chunk_type in PNG_KEEP_CHUNKS:
+            out.append(data[pos:end])
+        pos = end
+        if chunk_type == b'IEND':
+            return b''.join(out)
+    raise ValueError("PNG has no IEND chunk")
+
+
+def strip_webp(data):
+    """Remove EXIF/XMP/ICC chunks from a WebP without decoding it"""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise ValueError("Not a WebP file")
+    # Bytes after the RIFF container are not part of the image
+    riff_end = 8 + struct.unpack('<I', data[4:8])[0]
+    if riff_end > len(data):
+        raise ValueError("Truncated WebP file")
+    chunks = []
+    pos = 12
+    while pos + 8 <= riff_end:
+        chunk_type = data[pos:pos + 4]
+        length = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        # Chunks are padded to an even size
+        end = pos + 8 + length + (length & 1)
+        if end > riff_end + (length & 1):
+            raise ValueError("Truncated WebP chunk")
+        chunk = data[pos:end]
+        if chunk_type == b'VP8X':
+            # Clear the flags for the chunks being removed
+            flags = chunk[8] & ~WEBP_METADATA_FLAGS
+            chunk = chunk[:8] + bytes([flags]) + chunk[9:]
+        if chunk_type not in WEBP_METADATA_CHUNKS:
+            chunks.append(chunk)
+        pos = end
+    body = b'WEBP' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+STRIPPERS = {
+    'JPEG': strip_jpeg,
+    'PNG': strip_png,
+    'WEBP': strip_webp,
+}
+
+
+def strip_metadata(data, image_format):
+    """Remove metadata from encoded image bytes at the container level
+
+    Pixels are never decoded or re-encoded. Raises ValueError if the format
+    is unsupported or the file cannot be parsed, so callers can fall back
+    to decoding the image.
+    """
+    stripper = STRIPPERS.get(image_format)
+    if stripper is None:
+        raise ValueError(f"No container-level stripper for {image_format}")
+    return stripper(data)
@@ -0,0 +1,258 @@
+import os
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from process_local import ProcessLocal
+
+# Collect per-stage timings and serve them on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true') == 'true'
+# Store each upload's stage breakdown on its ProcessingSession row
+PERSIST_STAGE_TIMINGS = os.environ.get('PERSIST_STAGE_TIMINGS', 'false') == 'true'
+# Directory shared by the worker processes: each writes its metrics there and /metrics serves
+# their sum. Empty it when the service starts; an empty value keeps metrics per process.
+METRICS_DIR = os.environ.get('METRICS_DIR', 'metrics')
+
+METRIC_PREFIX = 'privacy_shield'
+# Histogram bucket upper bounds, in seconds
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Image size buckets (upper bound in megapixels, label)
+SIZE_BUCKETS = ((1, '0-1'), (4, '1-4'), (12, '4-12'), (math.inf, '12+'))
+
+_stage_timings = contextvars.ContextVar('stage_timings', default=None)
+
+
+def size_bucket(megapixels):
+    """Label of the size bucket an image falls in"""
+    if megapixels is None:
+        return 'unknown'
+    for limit, label in SIZE_BUCKETS:
+        if megapixels < limit:
+            return label
+    return SIZE_BUCKETS[-1][1]
+
+
+@contextmanager
+def stage(name):
+    """Add the time spent in the block to the named stage of the run being collected
+
+    Does nothing outside collect_stages(), so instrumented helpers cost
+    nothing when called on their own. Stages should not be nested.
+    """
+    timings = _stage_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def collects_stages(func):
+    """Decorator: time the stage() blocks func runs and add them to its result as 'stage_timings_ms'
+
+    Nested calls add to the outermost run's timings.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _stage_timings.get() is not None:
+            return func(*args, **kwargs)
+        timings = {}
+        token = _stage_timings.set(timings)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _stage_timings.reset(token)
+        result['stage_timings_ms'] = {name: round(ms, 1) for name, ms in timings.items()}
+        return result
+    return wrapper
+
+
+def _format_labels(label_names, values, extra=()):
+    pairs = list(zip(label_names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return '+Inf' if value == math.inf else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per set of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, (), value) for labels, value in sorted(self._values.items())]
+
+    def dump(self):
+        """JSON-serialisable values, for merge() in another process"""
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def merge(self, dumped):
+        """Add the values of another process's dump()"""
+        for labels, value in dumped:
+            self.inc(*labels, amount=value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per set of label values, as Prometheus expects"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [per-bucket counts, +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labels, (counts, total, value_sum) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', labels, (('le', _format_value(bound)),), cumulative))
+                samples.append((f'{self.name}_bucket', labels, (('le', '+Inf'),), total))
+                samples.append((f'{self.name}_sum', labels, (), value_sum))
+                samples.append((f'{self.name}_count', labels, (), total))
+        return samples
+
+    def dump(self):
+        """JSON-serialisable series, for merge() in another process"""
+        with self._lock:
+            return [[list(labels), list(counts), total, value_sum]
+                    for labels, (counts, total, value_sum) in self._series.items()]
+
+    def merge(self, dumped):
+        """Add the series of another process's dump(), which must use the same buckets"""
+        with self._lock:
+            for labels, counts, total, value_sum in dumped:
+                series = self._series.setdefault(tuple(labels), [[0] * len(self.buckets), 0, 0.0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += value_sum
+
+
+class ProcessingMetrics:
+    """Stage and request metrics, rendered in the Prometheus text format
+
+    With a directory, each process writes its metrics to its own file
+    there after every update, and render() sums the files of every process
+    that has shared the directory, including ones that have since exited,
+    so counters never go backwards when a worker is replaced.
+    """
+
+    def __init__(self, prefix=METRIC_PREFIX, directory=None):
+        self.prefix = prefix
+        self.directory = directory
+        self._save_lock = threading.Lock()
+        # Named per process rather than by pid alone, so a reused pid can't overwrite a dead worker's totals
+        self._filename = ProcessLocal(lambda: f"{os.getpid()}-{uuid.uuid4().hex}.json")
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.stage_seconds = Histogram(
+            f'{prefix}_stage_seconds', 'Time spent in each processing stage',
+            ('stage', 'detection_method', 'size_mp'))
+        self.processing_seconds = Histogram(
+            f'{prefix}_processing_seconds', 'Time to process one upload, end to end',
+            ('endpoint', 'detection_method', 'size_mp'))
+        self.requests = Counter(
+            f'{prefix}_processed_total', 'Uploads processed, by outcome',
+            ('endpoint', 'outcome'))
+        self.metrics = [self.stage_seconds, self.processing_seconds, self.requests]
+
+    def observe(self, endpoint, detection_method, megapixels, stage_timings_ms, processing_time_ms):
+        """Record one successfully processed upload"""
+        size = size_bucket(megapixels)
+        for name, ms in stage_timings_ms.items():
+            self.stage_seconds.observe(ms / 1000, name, detection_method, size)
+        self.processing_seconds.observe(processing_time_ms / 1000, endpoint, detection_method, size)
+        self.requests.inc(endpoint, 'success')
+        self._save()
+
+    def observe_failure(self, endpoint, outcome='error'):
+        """Count an upload that was rejected or failed"""
+        self.requests.inc(endpoint, outcome)
+        self._save()
+
+    def _save(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, self._filename.get())
+        tmp_path = f"{path}.tmp"
+        try:
+            with self._save_lock:
+                with open(tmp_path, 'w') as metrics_file:
+                    json.dump({metric.name: metric.dump() for metric in self.metrics}, metrics_file)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write metrics to {path}: {str(e)}")
+
+    def _combined(self):
+        # Sum of every process's file; this process's own is current as of its last update
+        combined = ProcessingMetrics(self.prefix)
+        by_name = {metric.name: metric for metric in combined.metrics}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as metrics_file:
+                    dumped = json.load(metrics_file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping unreadable metrics file {entry.path}: {str(e)}")
+                continue
+            for name, values in dumped.items():
+                if name in by_name:
+                    by_name[name].merge(values)
+        return combined
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format, summed across processes when sharing a directory"""
+        metrics = self._combined().metrics if self.directory else self.metrics
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, extra, value in metric.samples():
+                lines.append(f'{name}{_format_labels(metric.label_names, labels, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -11,7 +11,8 @@ class ProcessingSession(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_ip = db.Column(db.String(45), nullable=False)
     user_agent = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Indexed for the dashboard's recent-sessions query
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
     
     # Processing details
     original_filename = db.Column(db.String(255))
@@ -26,6 +27,8 @@ class ProcessingSession(db.Model):
     processing_success = db.Column(db.Boolean, default=True)
     error_message = db.Column(db.Text)
     processing_time_ms = db.Column(db.Integer)
+    # Milliseconds per pipeline stage, when PERSIST_STAGE_TIMINGS is on
+    stage_timings_ms = db.Column(db.JSON)
     
     def __repr__(self):
         return f'<ProcessingSession {self.id}: {self.faces_detected} faces>'
@@ -47,12 +50,20 @@ class ProcessingStats(db.Model):
     total_original_size_mb = db.Column(db.Float, default=0.0)
     total_processed_size_mb = db.Column(db.Float, default=0.0)
     
-    # Performance
-    avg_processing_time_ms = db.Column(db.Float, default=0.0)
+    # Performance: the sum is stored rather than a running average so that
+    # concurrent workers can add to it atomically
+    total_processing_time_ms = db.Column(db.Float, default=0.0)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    @property
+    def avg_processing_time_ms(self):
+        """Mean processing time of the day's images"""
+        if not self.total_images_processed:
+            return 0.0
+        return (self.total_processing_time_ms or 0.0) / self.total_images_processed
+    
     def __repr__(self):
         return f'<ProcessingStats {self.date}: {self.total_images_processed} images>'
 
@@ -61,7 +72,7 @@ class FaceDetection(db.Model):
     __tablename__ = 'face_detections'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id = db.Column(db.String(36), db.ForeignKey('processing_sessions.id'), nullable=False)
+    session_id = db.Column(db.String(36), db.ForeignKey('processing_sessions.id'), nullable=False, index=True)
     
     # Face detection details
     face_index = db.Column(db.Integer, nullable=False)  # Face number in image (1, 2, 3...)
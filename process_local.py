@@ -0,0 +1,34 @@
+import os
+import threading
+
+
+class ProcessLocal:
+    """A value built on first use in each process, such as a pool or background thread
+
+    Threads do not survive a fork, so pre-forked workers must not reuse a
+    pool or thread created in the parent. get() calls factory() the first
+    time it is called in each process and returns that value afterwards.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+
+    def get(self):
+        """This process's value, building it if needed"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def reset(self):
+        """Forget this process's value so the next get() builds a new one; returns the old value or None"""
+        with self._lock:
+            value = self._value if self._pid == os.getpid() else None
+            self._value = None
+            self._pid = None
+            return value
@@ -0,0 +1,639 @@
+"""Image and clip processing: metadata removal, face detection and blurring, encoding and previews
+
+Everything a request's processing needs and nothing of the web app, so the
+batch worker processes can import it without the app's database setup,
+background threads and routes.
+"""
+import os
+import logging
+import uuid
+import cv2
+import numpy as np
+import time
+from PIL import Image, ExifTags, ImageOps
+from PIL.ExifTags import TAGS
+import io
+import base64
+from metadata import strip_metadata
+from detection import DETECTION_MAX_EDGE, suppression_groups
+from anonymize import anonymize_region
+from detectors import DETECTORS, get_detector
+from retention import RETENTION_MAX_BYTES, RETENTION_TTL, FileStore
+from video import VIDEO_EXTENSIONS, FaceTracker, VideoReader, iter_animation_frames, open_video_writer, save_animated_webp
+from tiling import (MEMORY_BUDGET_MB, TILED_DETECTION_TILE, MemoryBudget, decoded_bytes, detection_image,
+                    in_memory_peak_bytes)
+from encoding import ENCODER_PRESET, converted_filename, encode_image, output_format_for, save_options
+from result_cache import RESULT_CACHE_DIR, RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_BYTES, ResultCache
+from coordinates import clip_face_boxes, empty_face_boxes, pad_face_boxes
+from metrics import collects_stages, stage
+
+UPLOAD_FOLDER = 'uploads'
+PROCESSED_FOLDER = 'processed'
+PREVIEW_FOLDER = 'previews'
+# 'client' uses the browser's face coordinates and falls back to the server detector when there
+# are none; 'hybrid' blurs both. Naming a detector backend forces server-side detection with it.
+SERVER_DETECTION_METHODS = ('server',) + tuple(DETECTORS)
+PREVIEW_MAX_EDGE = int(os.environ.get('PREVIEW_MAX_EDGE', 800))  # pixels
+
+# Generated files live in sharded stores that the sweeper expires and keeps under quota.
+# Uploads are processed in memory; the uploads store only clears out files left by older versions.
+upload_store = FileStore(UPLOAD_FOLDER, RETENTION_TTL, RETENTION_MAX_BYTES)
+processed_store = FileStore(PROCESSED_FOLDER, RETENTION_TTL, RETENTION_MAX_BYTES)
+preview_store = FileStore(PREVIEW_FOLDER, RETENTION_TTL, RETENTION_MAX_BYTES)
+
+# Processed outputs of repeated uploads are served from disk instead of being recomputed,
+# for as long as the other generated files are kept
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RETENTION_TTL) if RESULT_CACHE_ENABLED else None
+
+def open_image(image):
+    """Open an image from a path or file object (an open PIL image is returned as-is)"""
+    if isinstance(image, Image.Image):
+        return image
+    return Image.open(image)
+
+def load_image(image):
+    """Load an image as a BGR array from a path (arrays are returned as-is)"""
+    if isinstance(image, np.ndarray):
+        return image
+    img = cv2.imread(image)
+    if img is None:
+        raise ValueError("Could not load image")
+    return img
+
+def image_to_array(image):
+    """Decode a PIL image into a BGR array for OpenCV, plus its alpha channel if any"""
+    # Bake EXIF orientation into the pixels since the tag is not written back
+    ImageOps.exif_transpose(image, in_place=True)
+    alpha = None
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        alpha = image.getchannel('A')
+    return cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR), alpha
+
+def array_to_image(img, alpha=None):
+    """Convert a BGR array back to a PIL image, restoring its alpha channel"""
+    image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    if alpha is not None:
+        image.putalpha(alpha)
+    return image
+
+def remove_metadata(image_path):
+    """Remove EXIF metadata from image"""
+    try:
+        # Open image
+        image = open_image(image_path)
+        ImageOps.exif_transpose(image, in_place=True)
+        
+        # Copy the pixel buffer without any of the metadata in image.info
+        image_without_exif = image.copy()
+        image_without_exif.info = {key: image.info[key] for key in ('transparency',) if key in image.info}
+        
+        return image_without_exif
+    except Exception as e:
+        logging.error(f"Error removing metadata: {str(e)}")
+        raise
+
+def merge_face_boxes(*box_lists):
+    """Combine lists of face boxes, one box per face
+
+    Boxes of the same face (as non-maximum suppression groups them) are
+    replaced by the box enclosing them all, so every pixel of every input
+    box is still covered when the merged boxes are blurred.
+    """
+    face_boxes = np.array([tuple(box) for boxes in box_lists for box in boxes], dtype=np.int64).reshape(-1, 4)
+    groups = sorted(suppression_groups(face_boxes), key=lambda group: group[0])
+    if len(groups) < len(face_boxes):
+        logging.debug("Merged %d duplicate face boxes", len(face_boxes) - len(groups))
+    merged = []
+    for group in groups:
+        members = face_boxes[group]
+        x0, y0 = members[:, :2].min(axis=0)
+        x1, y1 = (members[:, :2] + members[:, 2:]).max(axis=0)
+        merged.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+    return merged
+
+def blur_face_regions(img, face_boxes, blur_strength=50, blur_method='gaussian', blur_shape='rectangle'):
+    """Anonymize each face box (plus padding) in place and return how many were blurred"""
+    faces_processed = 0
+    
+    with stage('blur'):
+        # Add padding around faces for better coverage
+        for x, y, w, h in pad_face_boxes(face_boxes, img.shape[1], img.shape[0]).tolist():
+            # Extract face region
+            face_region = img[y:y+h, x:x+w]
+            
+            if face_region.size > 0:
+                # Replace the face with its anonymized version (the region is a view into img)
+                anonymize_region(face_region, blur_strength, blur_method, blur_shape)
+                faces_processed += 1
+            else:
+                logging.warning("Face region at x=%d, y=%d is empty or invalid", x, y)
+    
+    return faces_processed
+
+def boxes_to_coordinates(face_boxes, scores=None):
+    """Convert (x, y, w, h) boxes to the coordinate dicts used by the frontend, with detector scores if any"""
+    coordinates = [{'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)} for (x, y, w, h) in face_boxes]
+    for face, score in zip(coordinates, scores or []):
+        if score is not None:
+            face['confidence'] = score
+    return coordinates
+
+def server_detector(detection_method):
+    """Detector backend for a detection method: the one it names, or the server default"""
+    return get_detector(detection_method if detection_method in DETECTORS else None)
+
+def detect_face_boxes(img, detector=None):
+    """Detect faces in a BGR array; returns boxes and their scores (None where the detector has none)"""
+    detector = detector or get_detector()
+    # Detect on a bounded-size copy; boxes come back in full-resolution pixels
+    with stage('detection'):
+        found = detector.detect(img)
+    return [box for box, _ in found], [score for _, score in found]
+
+def blur_faces_tiled(image, face_boxes, blur_strength, blur_method, blur_shape, budget):
+    """Anonymize faces in a PIL image in place, one padded face crop at a time
+
+    Only each face's crop is copied out to NumPy, so memory stays near the
+    decoded image itself however large it is.
+    """
+    faces_processed = 0
+    with stage('blur'):
+        for x, y, w, h in pad_face_boxes(face_boxes, image.size[0], image.size[1]).tolist():
+            if w <= 0 or h <= 0:
+                logging.warning("Face region at x=%d, y=%d is empty or invalid", x, y)
+                continue
+            crop = np.array(image.crop((x, y, x + w, y + h)))
+            with budget.holding(crop.nbytes * 2, 'Face region'):
+                if crop.ndim == 3:
+                    # Blur the colour channels in OpenCV's channel order; alpha is left alone
+                    bgr = cv2.cvtColor(np.ascontiguousarray(crop[:, :, :3]), cv2.COLOR_RGB2BGR)
+                    anonymize_region(bgr, blur_strength, blur_method, blur_shape)
+                    crop[:, :, :3] = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+                else:
+                    anonymize_region(crop, blur_strength, blur_method, blur_shape)
+                image.paste(Image.fromarray(crop, image.mode), (x, y))
+            faces_processed += 1
+    return faces_processed
+
+def blur_faces_from_coordinates(image, face_coordinates, blur_strength=50, blur_method='gaussian',
+                                blur_shape='rectangle'):
+    """Apply blur to client face boxes, an (N, 4) array from parse_face_coordinates()
+
+    image is a path or a BGR array, blurred in place.
+    """
+    try:
+        # Load the image
+        img = load_image(image)
+        
+        faces_processed = 0
+        
+        if len(face_coordinates):
+            face_boxes = merge_face_boxes(clip_face_boxes(face_coordinates, img.shape))
+            faces_processed = blur_face_regions(img, face_boxes, blur_strength, blur_method, blur_shape)
+        
+        logging.debug("Processed %d out of %d faces for blurring", faces_processed, len(face_coordinates))
+        return img, faces_processed
+    except Exception as e:
+        logging.error(f"Error in face blurring: {str(e)}")
+        raise
+
+def detect_and_blur_faces_opencv(image, blur_strength=50, blur_method='gaussian', blur_shape='rectangle',
+                                 detector=None):
+    """Detect and blur faces with a server-side detector (image is a path or a BGR array, blurred in place)"""
+    try:
+        # Load the image
+        img = load_image(image)
+        detector = detector or get_detector()
+        
+        all_faces, scores = detect_face_boxes(img, detector)
+        
+        # Apply blur to detected faces
+        faces_processed = blur_face_regions(img, all_faces, blur_strength, blur_method, blur_shape)
+        
+        logging.debug("OpenCV %s detector found and blurred %d faces", detector.name, faces_processed)
+        
+        return img, faces_processed, boxes_to_coordinates(all_faces, scores)
+        
+    except Exception as e:
+        logging.error(f"Error in OpenCV face detection: {str(e)}")
+        raise
+
+def get_image_metadata(image_path):
+    """Extract metadata information from image"""
+    try:
+        image = open_image(image_path)
+        exifdata = image.getexif()
+        
+        metadata = {}
+        if exifdata is not None:
+            for tag_id in exifdata:
+                tag = TAGS.get(tag_id, tag_id)
+                data = exifdata.get(tag_id)
+                if isinstance(data, bytes):
+                    data = data.decode()
+                metadata[tag] = data
+        
+        return metadata
+    except Exception as e:
+        logging.error(f"Error extracting metadata: {str(e)}")
+        return {}
+
+def image_to_base64(image_path):
+    """Convert image (a path or encoded bytes) to base64 for display"""
+    try:
+        if isinstance(image_path, bytes):
+            return base64.b64encode(image_path).decode()
+        with open(image_path, "rb") as img_file:
+            return base64.b64encode(img_file.read()).decode()
+    except Exception as e:
+        logging.error(f"Error converting image to base64: {str(e)}")
+        return None
+
+def result_cache_options(output_format, encoder_options, remove_meta, blur_faces, blur_strength, detection_method,
+                         face_coordinates, blur_method, blur_shape, tiled):
+    """The processing options that determine the output, for the result cache key"""
+    options = {
+        'format': output_format,
+        'encoder': encoder_options,
+        'remove_meta': remove_meta,
+        'blur_faces': blur_faces,
+    }
+    if blur_faces:
+        options.update(
+            blur_strength=blur_strength,
+            blur_method=blur_method,
+            blur_shape=blur_shape,
+            detection_method=detection_method,
+            detector=server_detector(detection_method).settings(),
+            # Tiled mode detects on a reduced copy, so its output can differ
+            processing_mode='tiled' if tiled else 'full',
+        )
+        # Client coordinates are ignored when detection is forced server-side
+        if detection_method not in SERVER_DETECTION_METHODS:
+            options['face_coordinates'] = face_coordinates.tolist()
+    return options
+
+def process_image_tiled(image, blur_strength, blur_method, blur_shape, detection_method, face_coordinates, budget):
+    """Detect and blur faces without decoding the image into NumPy arrays
+
+    Detection runs on overlapping tiles of a reduced copy, with
+    boxes merged across tile seams; blurring works one face crop at a time.
+    Returns the blurred PIL image, faces blurred and server-detected boxes.
+    """
+    with stage('decode'):
+        # Bake EXIF orientation into the pixels since the tag is not written back
+        ImageOps.exif_transpose(image, in_place=True)
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            has_alpha = 'A' in image.mode or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        image.load()
+    budget.reserve(decoded_bytes(image), 'Decoded image')
+    width, height = image.size
+    
+    client_boxes = []
+    if detection_method not in SERVER_DETECTION_METHODS:
+        client_boxes = clip_face_boxes(face_coordinates, (height, width))
+    
+    server_boxes = []
+    scores = []
+    if detection_method in SERVER_DETECTION_METHODS or detection_method == 'hybrid' or not len(client_boxes):
+        detector = server_detector(detection_method)
+        small, scale = detection_image(image, DETECTION_MAX_EDGE, color=detector.uses_color)
+        with budget.holding(small.nbytes, 'Detection image'), stage('detection'):
+            for box, score in detector.detect(small, tile_size=TILED_DETECTION_TILE, scale=scale):
+                server_boxes.append(box)
+                scores.append(score)
+        del small
+    
+    face_boxes = merge_face_boxes(client_boxes, server_boxes)
+    faces_detected = blur_faces_tiled(image, face_boxes, blur_strength, blur_method, blur_shape, budget)
+    logging.debug("Tiled processing of %dx%d image: %d client faces + %d server faces = %d blurred",
+                  width, height, len(client_boxes), len(server_boxes), faces_detected)
+    
+    # Pixels were edited in place, so drop the decoded image's metadata before encoding
+    image.info = {key: image.info[key] for key in ('transparency',) if key in image.info}
+    return image, faces_detected, boxes_to_coordinates(server_boxes, scores)
+
+@collects_stages
+def process_image(image_data, filename, remove_meta=True, blur_faces=True, blur_strength=50,
+                  detection_method='client', face_coordinates=None, preview_mode='inline',
+                  blur_method='gaussian', blur_shape='rectangle', processing_mode='auto',
+                  memory_budget_mb=MEMORY_BUDGET_MB, output_format=None, encoder_preset=ENCODER_PRESET,
+                  encoder_overrides=None):
+    """Remove metadata from and blur faces in an uploaded image held in memory
+
+    preview_mode 'inline' returns both images as base64, 'url' returns links
+    to cached thumbnails and 'none' returns no previews. processing_mode
+    'tiled' blurs without full-size NumPy copies; 'auto' switches to it
+    when the in-memory path would exceed memory_budget_mb. output_format
+    converts stills to another format; encoder_preset and encoder_overrides
+    pick the encoder settings used whenever pixels are re-encoded.
+    face_coordinates are the client's boxes as an (N, 4) array from
+    parse_face_coordinates(). The result's stage_timings_ms breaks the run
+    down by pipeline stage.
+    """
+    face_coordinates = empty_face_boxes() if face_coordinates is None else face_coordinates
+    clip_options = dict(remove_meta=remove_meta, blur_faces=blur_faces, blur_strength=blur_strength,
+                        preview_mode=preview_mode, blur_method=blur_method, blur_shape=blur_shape,
+                        detection_method=detection_method)
+    if filename.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS:
+        return process_clip(image_data, filename, **clip_options)
+    
+    # Generate unique filename
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    source_image = Image.open(io.BytesIO(image_data))
+    if source_image.format == 'WEBP' and getattr(source_image, 'is_animated', False):
+        return process_clip(image_data, filename, source_image=source_image, **clip_options)
+    
+    # Extract original metadata
+    with stage('metadata'):
+        original_metadata = get_image_metadata(source_image)
+    
+    # Process the image
+    output_format = output_format or output_format_for(filename, source_image.format or 'PNG')
+    encoder_options = save_options(output_format, encoder_preset, encoder_overrides)
+    processed_filename = f"processed_{converted_filename(unique_filename, output_format)}"
+    
+    faces_detected = 0
+    server_face_coords = []
+    processed_image = None
+    budget = MemoryBudget(memory_budget_mb * 1024 * 1024)
+    # Resolved before the cache lookup, since the mode is part of the key
+    tiled = blur_faces and (processing_mode == 'tiled' or (
+        processing_mode == 'auto' and budget.limit > 0 and in_memory_peak_bytes(source_image) > budget.limit))
+    encode_ms = None
+    
+    # Identical uploads with identical options reuse the earlier output
+    cache_key = None
+    cached = None
+    if result_cache is not None and (blur_faces or remove_meta):
+        cache_key = result_cache.make_key(image_data, result_cache_options(
+            output_format, encoder_options, remove_meta, blur_faces, blur_strength, detection_method,
+            face_coordinates, blur_method, blur_shape, tiled))
+        with stage('cache'):
+            cached = result_cache.get(cache_key)
+    
+    if cached is not None:
+        processed_data, cached_result = cached
+        faces_detected = cached_result['faces_detected']
+        server_face_coords = cached_result['face_coordinates']
+        encode_ms = cached_result.get('encode_ms')
+        logging.debug("Result cache hit for %s", filename)
+        if blur_faces and preview_mode == 'url':
+            processed_image = open_preview_source(processed_data, budget)
+    elif tiled:
+        processed_image, faces_detected, server_face_coords = process_image_tiled(
+            source_image, blur_strength, blur_method, blur_shape, detection_method, face_coordinates, budget)
+        processed_data, encode_ms = encode_image(processed_image, output_format, encoder_options)
+    elif blur_faces:
+        budget.reserve(in_memory_peak_bytes(source_image), 'Image')
+        # Decode once; detection and blurring share this array
+        with stage('decode'):
+            img, alpha = image_to_array(source_image)
+        
+        detector = server_detector(detection_method)
+        if detection_method in SERVER_DETECTION_METHODS:
+            # Force server-side OpenCV detection
+            logging.debug("Using OpenCV server-side %s face detection (forced)", detector.name)
+            img, faces_detected, server_face_coords = detect_and_blur_faces_opencv(img, blur_strength, blur_method,
+                                                                                   blur_shape, detector)
+        elif detection_method == 'hybrid':
+            # Use both client and server detection for maximum coverage
+            logging.debug("Using hybrid face detection (client + server)")
+            
+            # Detect on the original pixels, then blur the de-duplicated union in one pass
+            client_boxes = clip_face_boxes(face_coordinates, img.shape)
+            server_boxes, scores = detect_face_boxes(img, detector)
+            face_boxes = merge_face_boxes(client_boxes, server_boxes)
+            faces_detected = blur_face_regions(img, face_boxes, blur_strength, blur_method, blur_shape)
+            server_face_coords = boxes_to_coordinates(server_boxes, scores)
+            
+            logging.debug("Hybrid detection: %d client faces + %d server faces = %d total after de-duplication",
+                          len(client_boxes), len(server_boxes), faces_detected)
+        else:
+            # Default: client-side with server fallback
+            if len(face_coordinates):
+                logging.debug("Using client-side face detection coordinates")
+                img, faces_detected = blur_faces_from_coordinates(img, face_coordinates, blur_strength,
+                                                                  blur_method, blur_shape)
+            else:
+                logging.debug("No client-side faces found, using OpenCV server-side %s detection", detector.name)
+                img, faces_detected, server_face_coords = detect_and_blur_faces_opencv(img, blur_strength, blur_method,
+                                                                                       blur_shape, detector)
+        
+        # Encode once; pixels taken out of the array carry no metadata
+        processed_image = array_to_image(img, alpha)
+        processed_data, encode_ms = encode_image(processed_image, output_format, encoder_options)
+    elif remove_meta:
+        processed_data = None
+        # Drop metadata segments without decoding, unless EXIF orientation
+        # has to be baked into the pixels or the format needs converting
+        orientation = source_image.getexif().get(ExifTags.Base.Orientation, 1)
+        if orientation == 1 and source_image.format == output_format:
+            try:
+                with stage('metadata'):
+                    processed_data = strip_metadata(image_data, source_image.format)
+            except ValueError as e:
+                logging.warning(f"Container-level metadata removal failed, re-encoding: {str(e)}")
+        if processed_data is None:
+            with stage('metadata'):
+                clean_image = remove_metadata(source_image)
+            processed_data, encode_ms = encode_image(clean_image, output_format, encoder_options)
+    elif output_format != output_format_for(filename, source_image.format):
+        # Converting re-encodes the pixels, which leaves the metadata behind
+        processed_data, encode_ms = encode_image(ImageOps.exif_transpose(source_image), output_format,
+                                                 encoder_options)
+    else:
+        # Nothing to change, so the upload is returned as-is
+        processed_data = image_data
+    
+    if cache_key is not None and cached is None:
+        with stage('cache'):
+            result_cache.put(cache_key, processed_data, {
+                'faces_detected': faces_detected,
+                'face_coordinates': server_face_coords,
+                'encode_ms': encode_ms,
+            })
+    
+    # Only the processed file is persisted, for the download link
+    with stage('store'), processed_store.writing(processed_filename) as processed_path:
+        with open(processed_path, 'wb') as processed_file:
+            processed_file.write(processed_data)
+    
+    # Get file sizes
+    original_size = len(image_data)
+    processed_size = len(processed_data)
+    
+    result = {
+        'processed_filename': processed_filename,
+        'original_metadata': original_metadata,
+        'faces_detected': faces_detected,
+        'face_coordinates': server_face_coords,
+        'original_size': original_size,
+        'processed_size': processed_size,
+        'size_reduction': round(((original_size - processed_size) / original_size) * 100, 1),
+        'megapixels': round(source_image.size[0] * source_image.size[1] / 1_000_000, 2),
+        # face_coordinates are in these pixels, whatever the size of the previews
+        'width': source_image.size[0],
+        'height': source_image.size[1],
+        # Encoder timing is only reported when the pixels were re-encoded
+        'encoding': {
+            'format': output_format,
+            'preset': encoder_preset,
+            'options': encoder_options,
+            'encode_ms': encode_ms,
+        } if encode_ms is not None else None,
+        'cached': cached is not None,
+        'processing_mode': 'tiled' if tiled else 'full',
+        'estimated_peak_memory_mb': budget.estimated_peak_mb,
+    }
+    
+    with stage('preview'):
+        if preview_mode == 'inline':
+            # Convert images to base64 for preview
+            result['original_image'] = image_to_base64(image_data)
+            result['processed_image'] = image_to_base64(processed_data)
+        elif preview_mode == 'url':
+            # Thumbnails are written once and served by /preview
+            original_preview = save_preview(open_preview_source(image_data), f"original_{unique_filename}.webp")
+            processed_preview = original_preview
+            if processed_image is not None:
+                processed_preview = save_preview(processed_image, f"{processed_filename}.webp")
+            result['original_preview_url'] = f"/preview/{original_preview}"
+            result['processed_preview_url'] = f"/preview/{processed_preview}"
+    
+    return result
+
+def process_image_timed(image_data, filename, **options):
+    """process_image() plus the time it took, for use in worker processes"""
+    start_time = time.time()
+    result = process_image(image_data, filename, **options)
+    result['processing_time_ms'] = int((time.time() - start_time) * 1000)
+    return result
+
+def open_preview_source(image_data, budget=None):
+    """Open encoded image bytes for previewing, decoding JPEGs at a reduced scale
+
+    With a MemoryBudget, the decoded pixels are reserved against it first.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    # JPEG decoders can scale down by up to 8x while decoding
+    image.draft('RGB', (PREVIEW_MAX_EDGE, PREVIEW_MAX_EDGE))
+    if budget is not None:
+        budget.reserve(decoded_bytes(image), 'Decoded image')
+    return ImageOps.exif_transpose(image)
+
+def preview_thumbnail(image):
+    """Size-bounded RGB(A) copy of a PIL image for previews"""
+    width, height = image.size
+    scale = min(1.0, PREVIEW_MAX_EDGE / max(width, height))
+    preview = image
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        preview = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    if preview.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in preview.mode or 'transparency' in preview.info
+        preview = preview.convert('RGBA' if has_alpha else 'RGB')
+    return preview
+
+def save_preview(image, preview_filename):
+    """Write a size-bounded WebP thumbnail of a PIL image to the preview folder"""
+    with preview_store.writing(preview_filename) as preview_path:
+        preview_thumbnail(image).save(preview_path, 'WEBP', quality=80)
+    return preview_filename
+
+def process_clip(clip_data, filename, source_image=None, remove_meta=True, blur_faces=True, blur_strength=50,
+                 preview_mode='inline', blur_method='gaussian', blur_shape='rectangle', detection_method='client'):
+    """Blur faces in a video, or an animated WebP given as source_image, one frame at a time
+
+    Frames are decoded, blurred and encoded as they stream through, so only
+    a few are in memory whatever the clip's length. Faces are detected on
+    keyframes by the server detector for detection_method and tracked in
+    between; client coordinates belong to a still and are not used. Re-encoding drops container metadata (and audio).
+    Previews show the first frame.
+    """
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    processed_filename = f"processed_{unique_filename}"
+    extension = filename.rsplit('.', 1)[-1].lower()
+    tracker = FaceTracker(server_detector(detection_method))
+    previews = {}
+    counts = {'frames': 0, 'frames_with_faces': 0, 'megapixels': None, 'width': None, 'height': None}
+    
+    def anonymize(frame):
+        """Blur one BGR frame in place"""
+        if counts['frames'] == 0:
+            counts['megapixels'] = round(frame.shape[0] * frame.shape[1] / 1_000_000, 2)
+            counts['height'], counts['width'] = frame.shape[:2]
+        first = counts['frames'] == 0 and preview_mode != 'none'
+        if first:
+            previews['original'] = preview_thumbnail(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+        if blur_faces:
+            with stage('detection'):
+                face_boxes = tracker.update(frame)
+            if blur_face_regions(frame, face_boxes, blur_strength, blur_method, blur_shape):
+                counts['frames_with_faces'] += 1
+        if first:
+            previews['processed'] = preview_thumbnail(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+        counts['frames'] += 1
+        return frame
+    
+    with processed_store.writing(processed_filename) as processed_path:
+        if not (blur_faces or remove_meta):
+            # Nothing to change, so the upload is returned as-is
+            with open(processed_path, 'wb') as processed_file:
+                processed_file.write(clip_data)
+        elif source_image is not None:
+            frames = ((Image.fromarray(np.dstack((cv2.cvtColor(anonymize(bgr), cv2.COLOR_BGR2RGB), alpha)), 'RGBA'),
+                       duration)
+                      for bgr, alpha, duration in iter_animation_frames(source_image))
+            save_animated_webp(processed_path, frames, source_image.n_frames, loop=source_image.info.get('loop', 0))
+        else:
+            with upload_store.scratch(unique_filename, clip_data) as source_path, VideoReader(source_path) as reader:
+                writer = None
+                try:
+                    for frame in reader:
+                        if writer is None:
+                            # Size the output from decoded frames, which OpenCV may have rotated
+                            writer = open_video_writer(processed_path, extension, reader.fps,
+                                                       (frame.shape[1], frame.shape[0]))
+                        frame = anonymize(frame)
+                        with stage('encode'):
+                            writer.write(frame)
+                finally:
+                    if writer is not None:
+                        writer.release()
+                if writer is None:
+                    raise ValueError("Video has no frames")
+    
+    original_size = len(clip_data)
+    processed_size = os.path.getsize(processed_store.path_for(processed_filename))
+    logging.debug("Processed %d frames of %s: %d faces tracked, %d frames blurred",
+                  counts['frames'], filename, tracker.faces_seen, counts['frames_with_faces'])
+    
+    result = {
+        'processed_filename': processed_filename,
+        'original_metadata': get_image_metadata(source_image) if source_image is not None else {},
+        'faces_detected': tracker.faces_seen,
+        'face_coordinates': [],
+        'original_size': original_size,
+        'processed_size': processed_size,
+        'size_reduction': round(((original_size - processed_size) / original_size) * 100, 1),
+        'megapixels': counts['megapixels'],
+        'width': counts['width'],
+        'height': counts['height'],
+        'cached': False,
+        'frames': counts['frames'],
+        'frames_with_faces': counts['frames_with_faces'],
+    }
+    
+    if previews and preview_mode == 'url':
+        result['original_preview_url'] = f"/preview/{save_preview(previews['original'], f'original_{unique_filename}.webp')}"
+        result['processed_preview_url'] = f"/preview/{save_preview(previews['processed'], f'{processed_filename}.webp')}"
+    elif previews and preview_mode == 'inline':
+        for key in ('original', 'processed'):
+            buffer = io.BytesIO()
+            previews[key].save(buffer, 'WEBP', quality=80)
+            result[f'{key}_image'] = image_to_base64(buffer.getvalue())
+    
+    return result
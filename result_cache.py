@@ -0,0 +1,168 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+
+# Cache of processed outputs keyed on the upload's content and the options used
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true') == 'true'
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', 'cache')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Eviction trims the cache to this fraction of its limit, so it doesn't run on every write
+EVICT_TO = 0.9
+# Temporary files older than this are left over from a crash and removed during eviction
+STALE_TMP_AGE = 3600
+
+
+class ResultCache:
+    """Content-addressed store of processed images and their detection results
+
+    Each entry is one file holding a JSON metadata line followed by the
+    processed bytes, written atomically so concurrent workers sharing the
+    directory never see partial entries. An entry's mtime is when it was
+    written and its atime when it was last read: entries older than ttl are
+    deleted like any other retained file, and eviction removes the least
+    recently used entries once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes, ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, options):
+        """Hash of the image bytes and the options that affect the output"""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(options, sort_keys=True, separators=(',', ':')).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        # Shard by prefix to keep directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """(data, metadata) for key, or None if it is not cached"""
+        path = self._path(key)
+        try:
+            now = time.time()
+            written_at = os.stat(path).st_mtime
+            if written_at < now - self.ttl:
+                # Expired but not yet swept
+                raise FileNotFoundError(path)
+            with open(path, 'rb') as cache_file:
+                metadata = json.loads(cache_file.readline())
+                data = cache_file.read()
+            os.utime(path, (now, written_at))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unreadable result cache entry {key}: {str(e)}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data, metadata
+
+    def put(self, key, data, metadata):
+        """Store data and its JSON-serialisable metadata under key"""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as cache_file:
+                cache_file.write(json.dumps(metadata).encode() + b'\n')
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write result cache entry {key}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += len(data)
+            needs_eviction = self._bytes is None or self._bytes > self.max_bytes
+        if needs_eviction:
+            self.sweep()
+
+    def sweep(self):
+        """Remove expired entries, then least recently used ones until the cache is back under its limit"""
+        with self._evict_lock:
+            # Scan the directory rather than trusting in-memory totals, since
+            # other worker processes write to it too
+            entries = []
+            now = time.time()
+            expired = 0
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    try:
+                        stat = entry.stat()
+                        if entry.name.endswith('.tmp'):
+                            if now - stat.st_mtime > STALE_TMP_AGE:
+                                os.remove(entry.path)
+                            continue
+                        if now - stat.st_mtime > self.ttl:
+                            os.remove(entry.path)
+                            expired += 1
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            if total > self.max_bytes:
+                entries.sort()
+                target = self.max_bytes * EVICT_TO
+                for _, size, path in entries:
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    evicted += 1
+                logging.info(f"Result cache evicted {evicted} entries, {total / 1024 / 1024:.1f}MB remaining")
+
+            if expired:
+                logging.info(f"Result cache expired {expired} entries")
+
+            with self._lock:
+                self._bytes = total
+                self.evictions += evicted
+                self.expired += expired
+
+    def stats(self):
+        """Hit, miss, eviction and expiry counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+            }
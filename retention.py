@@ -0,0 +1,201 @@
+import os
+import logging
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from process_local import ProcessLocal
+
+# Files older than this many seconds are deleted by the sweeper
+RETENTION_TTL = int(os.environ.get('RETENTION_TTL', 3600))
+# Largest size each managed directory may reach before the oldest files are deleted
+RETENTION_MAX_BYTES = int(os.environ.get('RETENTION_MAX_BYTES', 1024 * 1024 * 1024))
+# Seconds between sweeps
+RETENTION_SWEEP_INTERVAL = int(os.environ.get('RETENTION_SWEEP_INTERVAL', 60))
+# Run the background sweeper in each web worker
+RETENTION_SWEEPER = os.environ.get('RETENTION_SWEEPER', 'true') == 'true'
+
+SHARD_COUNT = 256
+# Temporary files keep the real name at the end, since some writers pick the format from the extension
+TMP_PREFIX = '.tmp-'
+KEEP_FILES = {'.gitkeep'}
+
+
+class FileStore:
+    """A directory of generated files, spread over sharded subdirectories
+
+    Files are addressed by name alone; the shard is derived from a hash of
+    the name, so no directory ends up holding every file.
+    """
+
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.expired = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def shard(filename):
+        """Subdirectory name for a file"""
+        return f"{zlib.crc32(filename.encode()) % SHARD_COUNT:02x}"
+
+    def relative_path(self, filename):
+        """Path of a file relative to the store's directory"""
+        return os.path.join(self.shard(filename), filename)
+
+    def path_for(self, filename):
+        """Full path where a file is stored"""
+        return os.path.join(self.directory, self.relative_path(filename))
+
+    def find(self, filename):
+        """Relative path of an existing file, or None
+
+        Files written before sharding was introduced are still found at the
+        top level until the sweeper removes them.
+        """
+        if filename in ('', '.', '..') or filename.startswith(TMP_PREFIX) or os.sep in filename or \
+                (os.altsep and os.altsep in filename):
+            return None
+        for relative in (self.relative_path(filename), filename):
+            if os.path.isfile(os.path.join(self.directory, relative)):
+                return relative
+        return None
+
+    def _temporary_path(self, filename):
+        path = self.path_for(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_name = f"{TMP_PREFIX}{os.getpid()}-{threading.get_ident()}-{filename}"
+        return path, os.path.join(os.path.dirname(path), tmp_name)
+
+    @contextmanager
+    def writing(self, filename):
+        """Yield a temporary path to write a file to, moved into place on success
+
+        If the block raises, the temporary file is deleted, so failed writes
+        never leave partial files behind.
+        """
+        path, tmp_path = self._temporary_path(filename)
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @contextmanager
+    def scratch(self, filename, data):
+        """Yield the path of a temporary copy of data, deleted when the block exits
+
+        For libraries that can only read from a file; the sweeper removes
+        copies left behind by a crashed worker.
+        """
+        _, tmp_path = self._temporary_path(filename)
+        try:
+            with open(tmp_path, 'wb') as scratch_file:
+                scratch_file.write(data)
+            yield tmp_path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _scan(self):
+        # Yields (path, stat) for every file, sharded or left at the top level
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_dir():
+                    for shard_entry in os.scandir(entry.path):
+                        if shard_entry.is_file():
+                            yield shard_entry.path, shard_entry.stat()
+                elif entry.is_file() and entry.name not in KEEP_FILES:
+                    yield entry.path, entry.stat()
+            except FileNotFoundError:
+                continue
+
+    def sweep(self):
+        """Delete expired files, then the oldest files while over the size quota"""
+        cutoff = time.time() - self.ttl
+        kept = []
+        expired = 0
+        for path, stat in self._scan():
+            # Temporary files get the same TTL, which is far longer than any write
+            is_temporary = os.path.basename(path).startswith(TMP_PREFIX)
+            if stat.st_mtime < cutoff:
+                try:
+                    os.remove(path)
+                    expired += 1
+                except FileNotFoundError:
+                    pass
+            elif not is_temporary:
+                kept.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in kept)
+        evicted = 0
+        if total > self.max_bytes:
+            kept.sort()
+            for _, size, path in kept:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        with self._lock:
+            self.files = len(kept) - evicted
+            self.bytes = total
+            self.expired += expired
+            self.evicted += evicted
+        if expired or evicted:
+            logging.info(f"Swept {self.directory}: {expired} expired, {evicted} evicted over quota, "
+                         f"{total / 1024 / 1024:.1f}MB kept")
+
+    def stats(self):
+        """File counts and totals as of the last sweep"""
+        with self._lock:
+            return {'files': self.files, 'bytes': self.bytes, 'expired': self.expired,
+                    'evicted': self.evicted, 'ttl': self.ttl, 'max_bytes': self.max_bytes}
+
+
+class RetentionSweeper:
+    """Background thread that sweeps a set of FileStores at a fixed interval"""
+
+    def __init__(self, stores, interval):
+        self.stores = stores
+        self.interval = interval
+        self._thread = ProcessLocal(self._start_thread)
+        self._stop = threading.Event()
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._run, name='retention-sweeper', daemon=True)
+        thread.start()
+        return thread
+
+    def ensure_started(self):
+        """Start the sweeper thread in this process if it isn't running"""
+        self._thread.get()
+
+    def sweep(self):
+        """Sweep every store once"""
+        for store in self.stores:
+            try:
+                store.sweep()
+            except Exception as e:
+                logging.error(f"Retention sweep of {store.directory} failed: {str(e)}")
+
+    def _run(self):
+        while True:
+            self.sweep()
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop the sweeper thread"""
+        self._stop.set()
@@ -45,12 +45,13 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     function handleFileSelect(file) {
-        const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp'];
+        const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp',
+                              'video/mp4', 'video/quicktime', 'video/webm', 'video/x-msvideo', 'video/avi'];
         const maxSize = 16 * 1024 * 1024; // 16MB
 
 
         if (!allowedTypes.includes(file.type)) {
-            showAlert('Please select a valid image file (JPG, PNG, or WEBP)', 'danger');
+            showAlert('Please select a valid image or video file (JPG, PNG, WEBP, MP4, MOV, WEBM or AVI)', 'danger');
             resetFileInput();
             return;
         }
@@ -91,7 +92,7 @@ document.addEventListener('DOMContentLoaded', function() {
         uploadContent.innerHTML = `
             <i class="fas fa-cloud-upload-alt fs-1 text-muted mb-3"></i>
             <h4>Drag & Drop or Click to Upload</h4>
-            <p class="text-muted">Supports: JPG, PNG, WEBP (Max 16MB)</p>
+            <p class="text-muted">Supports: JPG, PNG, WEBP, MP4, MOV, WEBM, AVI (Max 16MB)</p>
             <button type="button" class="btn btn-outline-primary" onclick="document.getElementById('fileInput').click()">
                 <i class="fas fa-folder-open me-2"></i>Choose File
             </button>
@@ -119,10 +120,16 @@ document.addEventListener('DOMContentLoaded', function() {
         formData.append('remove_metadata', document.getElementById('removeMetadata').checked);
         formData.append('blur_faces', document.getElementById('blurFaces').checked);
         formData.append('blur_strength', document.getElementById('blurStrength').value);
+        formData.append('blur_method', document.getElementById('blurMethod').value);
+        formData.append('blur_shape', document.getElementById('blurEllipse').checked ? 'ellipse' : 'rectangle');
+        formData.append('output_format', document.getElementById('outputFormat').value);
+        formData.append('encoder_preset', document.getElementById('encoderPreset').value);
         
         
         const detectionMethod = document.querySelector('input[name="detectionMethod"]:checked').value;
         formData.append('detection_method', detectionMethod);
+        // Ask for thumbnail links instead of full-size base64 images
+        formData.append('preview_mode', 'url');
         
       
         if (detectedFaces.length > 0) {
@@ -208,8 +215,8 @@ document.addEventListener('DOMContentLoaded', function() {
         summary.innerHTML = summaryText;
 
         
-        document.getElementById('originalImage').src = `data:image/jpeg;base64,${data.original_image}`;
-        document.getElementById('processedImage').src = `data:image/jpeg;base64,${data.processed_image}`;
+        document.getElementById('originalImage').src = data.original_preview_url || `data:image/jpeg;base64,${data.original_image}`;
+        document.getElementById('processedImage').src = data.processed_preview_url || `data:image/jpeg;base64,${data.processed_image}`;
 
         
         const metadataInfo = document.getElementById('metadataInfo');
@@ -308,9 +315,11 @@ document.addEventListener('DOMContentLoaded', function() {
         if (e.target.checked) {
             blurControls.style.opacity = '1';
             document.getElementById('blurStrength').disabled = false;
+            document.getElementById('blurMethod').disabled = false;
         } else {
             blurControls.style.opacity = '0.5';
             document.getElementById('blurStrength').disabled = true;
+            document.getElementById('blurMethod').disabled = true;
         }
     });
     
@@ -360,7 +369,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Draw face detection boxes and labels (supports both client and server detections)
-    function drawFaceDetections(imageElement, clientDetections = [], serverDetections = []) {
+    function drawFaceDetections(imageElement, clientDetections = [], serverDetections = [], originalWidth = null, originalHeight = null) {
         const canvas = document.getElementById('originalCanvas');
         if (!canvas) {
             console.warn('Canvas element not found');
@@ -388,14 +397,17 @@ document.addEventListener('DOMContentLoaded', function() {
         // Calculate scale factors from natural image size to displayed size
         const scaleX = imageElement.offsetWidth / imageElement.naturalWidth;
         const scaleY = imageElement.offsetHeight / imageElement.naturalHeight;
+        // Server boxes are in full-size image pixels, while the image shown may be a smaller preview
+        const serverScaleX = imageElement.offsetWidth / (originalWidth || imageElement.naturalWidth);
+        const serverScaleY = imageElement.offsetHeight / (originalHeight || imageElement.naturalHeight);
         
         // Draw server detections (OpenCV results) - these are authoritative
         if (serverDetections && serverDetections.length > 0) {
             serverDetections.forEach((detection, index) => {
-                const x = detection.x * scaleX;
-                const y = detection.y * scaleY;
-                const width = detection.width * scaleX;
-                const height = detection.height * scaleY;
+                const x = detection.x * serverScaleX;
+                const y = detection.y * serverScaleY;
+                const width = detection.width * serverScaleX;
+                const height = detection.height * serverScaleY;
                 
                 // Draw server detection box (green for server authority)
                 ctx.strokeStyle = '#22c55e';
@@ -670,13 +682,15 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             // Draw face detections (both server and client)
-            drawFaceDetections(originalImage, clientDetections, serverDetections);
+            drawFaceDetections(originalImage, clientDetections, serverDetections, data.width, data.height);
             
             // Display integrated face information
             displayFaceInfo(clientDetections, data);
             
-            // Store detections for form submission
-            detectedFaces = clientDetections;
+            // Store detections for form submission, in full-size pixels as the server expects
+            detectedFaces = data.width && data.height
+                ? clientDetections.map(face => ({...face, detection: face.detection.forSize(data.width, data.height)}))
+                : clientDetections;
         };
     };
 });
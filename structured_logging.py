@@ -0,0 +1,62 @@
+import os
+import json
+import logging
+
+# Root log level; DEBUG adds per-face and per-decision detail
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'text' for basicConfig-style lines, 'json' for one JSON object per line
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_FORMATS = ('text', 'json')
+
+
+def _json_value(value):
+    return json.dumps(value, default=str, separators=(',', ':'))
+
+
+class TextFormatter(logging.Formatter):
+    """basicConfig-style lines, with a record's fields appended as key=value pairs"""
+
+    def __init__(self):
+        super().__init__(logging.BASIC_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={_json_value(value)}' for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with a record's fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return _json_value(entry)
+
+
+def configure_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """Set the root log level and, unless a handler is already installed, the output format"""
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown LOG_FORMAT {log_format!r}. Choose one of: {', '.join(LOG_FORMATS)}")
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+        root.addHandler(handler)
+    root.setLevel(level)
+    # Pillow logs every chunk it parses at DEBUG, which would drown out the app's own detail
+    logging.getLogger('PIL').setLevel(max(root.level, logging.INFO))
+
+
+def log_fields(level, message, *args, **fields):
+    """Log one record carrying structured fields (top-level keys in JSON, key=value pairs in text)"""
+    logging.log(level, message, *args, extra={'fields': fields})
@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# app reads its configuration at import, so point it at a scratch SQLite
+# database and turn off background work before any test imports it
+os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/test.db'
+os.environ['ANALYTICS_WRITE_BEHIND'] = 'false'
+os.environ['RESULT_CACHE_ENABLED'] = 'false'
+os.environ['RETENTION_SWEEPER'] = 'false'
+os.environ['WARMUP_DETECTORS'] = 'false'
+os.environ['METRICS_DIR'] = tempfile.mkdtemp()
@@ -0,0 +1,82 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app import app
+from coordinates import (MAX_COORDINATE, MAX_FACE_COORDINATES, CoordinateError, clip_face_boxes,
+                         face_boxes_from_coordinates, parse_face_coordinates)
+
+
+def box(x=10, y=20, width=30, height=40):
+    return {'x': x, 'y': y, 'width': width, 'height': height}
+
+
+def test_boxes_are_parsed_to_whole_pixels():
+    boxes = parse_face_coordinates(json.dumps([box(), box(1.9, 2.5, 3.7, 4.2) | {'imageWidth': 640}]))
+    assert boxes.dtype == np.int64
+    assert boxes.tolist() == [[10, 20, 30, 40], [1, 2, 3, 4]]
+
+
+@pytest.mark.parametrize('payload', [None, '', '   ', '[]'])
+def test_no_boxes(payload):
+    assert parse_face_coordinates(payload).shape == (0, 4)
+
+
+@pytest.mark.parametrize('payload', [
+    'not json',
+    '{"x": 1}',
+    '[1, 2, 3, 4]',
+    json.dumps([{'x': 1, 'y': 2, 'width': 3}]),
+    json.dumps([box(x='10')]),
+    json.dumps([box(y=None)]),
+    json.dumps([box(width=True)]),
+    json.dumps([box(height=[4])]),
+    '[{"x": NaN, "y": 0, "width": 1, "height": 1}]',
+    '[{"x": 0, "y": Infinity, "width": 1, "height": 1}]',
+    json.dumps([box(width=0)]),
+    json.dumps([box(height=-5)]),
+])
+def test_malformed_coordinates_are_rejected(payload):
+    with pytest.raises(CoordinateError):
+        parse_face_coordinates(payload)
+
+
+def test_too_many_boxes_are_rejected():
+    assert len(face_boxes_from_coordinates([box()] * 3, max_faces=3)) == 3
+    with pytest.raises(CoordinateError, match='Too many'):
+        face_boxes_from_coordinates([box()] * 4, max_faces=3)
+
+
+def test_oversized_payload_is_rejected_before_parsing():
+    # Not valid JSON either, so only the length check can have refused it
+    with pytest.raises(CoordinateError, match='Too many'):
+        parse_face_coordinates('[' + ' ' * 10000, max_faces=2)
+
+
+def test_huge_numbers_are_clamped_before_conversion():
+    boxes = face_boxes_from_coordinates([box(x=1e300, y=-1e300, width=1e300, height=1e300)])
+    assert boxes.tolist() == [[MAX_COORDINATE, -MAX_COORDINATE, MAX_COORDINATE, MAX_COORDINATE]]
+
+
+def test_out_of_bounds_boxes_are_clipped_to_the_image():
+    boxes = np.array([[-20, -10, 50, 40], [90, 70, 100, 100], [500, 500, 10, 10],
+                      [0, 0, MAX_COORDINATE, MAX_COORDINATE]])
+    clipped = clip_face_boxes(boxes, (80, 100, 3))
+    assert clipped.tolist() == [[0, 0, 50, 40], [90, 70, 10, 10], [99, 79, 1, 1], [0, 0, 100, 80]]
+
+
+def test_upload_rejects_bad_coordinates_with_400():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(buffer, 'PNG')
+    client = app.test_client()
+    for payload in ('[{"x": "a"}]', json.dumps([box()] * (MAX_FACE_COORDINATES + 1))):
+        response = client.post('/upload', data={
+            'file': (io.BytesIO(buffer.getvalue()), 'face.png'),
+            'detection_method': 'client',
+            'face_coordinates': payload,
+        })
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
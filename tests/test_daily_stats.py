@@ -0,0 +1,81 @@
+import threading
+from datetime import date
+
+import pytest
+
+from app import COLUMN_BACKFILLS, add_missing_columns, app, database_enabled, db, update_daily_stats
+from models import ProcessingStats
+
+THREADS = 16
+UPDATES_PER_THREAD = 50
+
+
+@pytest.fixture(autouse=True)
+def empty_stats():
+    assert database_enabled
+    with app.app_context():
+        ProcessingStats.query.delete()
+        db.session.commit()
+    yield
+
+
+def test_concurrent_updates_are_not_lost():
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        start.wait()
+        with app.app_context():
+            for _ in range(UPDATES_PER_THREAD):
+                try:
+                    update_daily_stats(1024 * 1024, 512 * 1024, True, 2, True, 10)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    updates = THREADS * UPDATES_PER_THREAD
+    with app.app_context():
+        stats = ProcessingStats.query.filter_by(date=date.today()).one()
+        assert stats.total_images_processed == updates
+        assert stats.total_faces_detected == 2 * updates
+        assert stats.total_metadata_removals == updates
+        assert stats.total_face_blurs == updates
+        assert stats.total_original_size_mb == pytest.approx(updates)
+        assert stats.total_processed_size_mb == pytest.approx(updates / 2)
+        assert stats.total_processing_time_ms == pytest.approx(10 * updates)
+        assert stats.avg_processing_time_ms == pytest.approx(10)
+
+
+def test_added_total_is_backfilled_from_running_average():
+    table = ProcessingStats.__table__
+    assert (table.name, 'total_processing_time_ms') in COLUMN_BACKFILLS
+    with app.app_context():
+        # Recreate the table as it was before total_processing_time_ms
+        table.drop(db.engine)
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE processing_stats (id INTEGER PRIMARY KEY, date DATE NOT NULL UNIQUE, '
+                'total_images_processed INTEGER, total_faces_detected INTEGER, '
+                'total_metadata_removals INTEGER, total_face_blurs INTEGER, '
+                'total_original_size_mb FLOAT, total_processed_size_mb FLOAT, '
+                'avg_processing_time_ms FLOAT, created_at DATETIME, updated_at DATETIME)')
+            connection.exec_driver_sql(
+                "INSERT INTO processing_stats (date, total_images_processed, avg_processing_time_ms) "
+                "VALUES ('2024-01-01', 100, 500.0), ('2024-01-02', NULL, NULL)")
+
+        add_missing_columns()
+
+        update_daily_stats(0, 0, False, 0, False, 1500, day=date(2024, 1, 1))
+        db.session.commit()
+        first, second = ProcessingStats.query.order_by(ProcessingStats.date).all()
+        assert first.total_processing_time_ms == pytest.approx(100 * 500 + 1500)
+        assert first.avg_processing_time_ms == pytest.approx((100 * 500 + 1500) / 101)
+        assert second.total_processing_time_ms == 0
@@ -0,0 +1,63 @@
+import itertools
+
+import numpy as np
+
+from detection import box_iou_matrix, filter_faces, non_max_suppression, suppression_groups
+
+# Two views of one face, a smaller box inside the first, and a face elsewhere
+BIG = (100, 100, 100, 100)
+SHIFTED = (110, 105, 100, 100)
+INSIDE = (120, 120, 60, 60)
+ELSEWHERE = (400, 50, 80, 80)
+
+
+def reference_nms(boxes, scores, iou_threshold):
+    # The nested loop the vectorised version replaced, ranking by score then position
+    order = sorted(range(len(boxes)), key=lambda i: (-scores[i], *boxes[i]))
+    kept = []
+    for i in order:
+        if all(box_iou_matrix([boxes[i]], [boxes[j]])[0, 0] <= iou_threshold for j in kept):
+            kept.append(i)
+    return kept
+
+
+def test_larger_box_is_kept_and_overlapping_ones_suppressed():
+    boxes = [INSIDE, SHIFTED, ELSEWHERE, BIG]
+    # BIG and SHIFTED tie on area, so the one further left and up wins
+    assert non_max_suppression(boxes).tolist() == [3, 2]
+
+
+def test_groups_list_the_kept_box_first_then_what_it_suppressed():
+    groups = suppression_groups([INSIDE, SHIFTED, ELSEWHERE, BIG])
+    # Suppressed boxes follow in rank order too
+    assert [group.tolist() for group in groups] == [[3, 1, 0], [2]]
+
+
+def test_scores_rank_boxes_before_area():
+    assert non_max_suppression([BIG, INSIDE], scores=[0.2, 0.9]).tolist() == [1]
+
+
+def test_kept_boxes_do_not_depend_on_input_order():
+    boxes = [BIG, SHIFTED, INSIDE, ELSEWHERE]
+    expected = {BIG, ELSEWHERE}
+    for permutation in itertools.permutations(boxes):
+        kept = non_max_suppression(permutation)
+        assert {permutation[i] for i in kept} == expected
+
+
+def test_matches_the_greedy_loop_on_random_boxes():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        boxes = [tuple(int(v) for v in box) for box in
+                 np.column_stack((rng.integers(0, 300, (40, 2)), rng.integers(20, 120, (40, 2))))]
+        scores = rng.random(len(boxes)).tolist()
+        assert non_max_suppression(boxes, scores, 0.3).tolist() == reference_nms(boxes, scores, 0.3)
+
+
+def test_no_boxes():
+    assert non_max_suppression([]).tolist() == []
+    assert filter_faces([]) == []
+
+
+def test_filter_faces_returns_faces_top_to_bottom():
+    assert filter_faces([SHIFTED, ELSEWHERE, BIG, (0, 0, 100, 20)]) == [ELSEWHERE, BIG]
@@ -0,0 +1,45 @@
+import numpy as np
+from PIL import Image
+
+from processing import blur_faces_from_coordinates, blur_faces_tiled, merge_face_boxes
+from tiling import MemoryBudget
+
+# Two client boxes on the same face, offset so that neither contains the other
+OFFSET_BOXES = [(100, 100, 80, 80), (130, 115, 80, 80)]
+SEPARATE_BOX = (300, 60, 50, 50)
+
+
+def fixture_image():
+    # No pixel is black, so every pixel a solid fill covers is changed
+    rng = np.random.default_rng(0)
+    return rng.integers(1, 256, (240, 400, 3), dtype=np.uint8)
+
+
+def assert_boxes_changed(original, blurred, boxes):
+    for x, y, w, h in boxes:
+        unchanged = (original[y:y + h, x:x + w] == blurred[y:y + h, x:x + w]).all(axis=2)
+        assert not unchanged.any(), f"{unchanged.sum()} pixels of box {(x, y, w, h)} were left as they were"
+
+
+def test_merge_counts_one_box_per_face_and_covers_every_input_box():
+    merged = merge_face_boxes(OFFSET_BOXES, [SEPARATE_BOX])
+    assert len(merged) == 2
+    for x, y, w, h in OFFSET_BOXES + [SEPARATE_BOX]:
+        assert any(mx <= x and my <= y and x + w <= mx + mw and y + h <= my + mh for mx, my, mw, mh in merged)
+
+
+def test_every_pixel_of_overlapping_client_boxes_is_blurred():
+    original = fixture_image()
+    boxes = np.array(OFFSET_BOXES + [SEPARATE_BOX])
+    blurred, faces = blur_faces_from_coordinates(original.copy(), boxes, blur_method='fill')
+    assert faces == 2
+    assert_boxes_changed(original, blurred, boxes)
+
+
+def test_every_pixel_of_overlapping_boxes_is_blurred_in_tiled_mode():
+    original = fixture_image()
+    image = Image.fromarray(original)
+    boxes = merge_face_boxes(OFFSET_BOXES, [SEPARATE_BOX])
+    faces = blur_faces_tiled(image, boxes, 50, 'fill', 'rectangle', MemoryBudget(0))
+    assert faces == 2
+    assert_boxes_changed(original, np.asarray(image), OFFSET_BOXES + [SEPARATE_BOX])
@@ -0,0 +1,48 @@
+import threading
+
+from jobs import JobQueue
+from retention import FileStore
+
+
+def make_queue(directory, max_finished=10):
+    return JobQueue(1, 4, FileStore(str(directory), 600, 1024 * 1024), max_finished)
+
+
+def test_another_worker_sees_the_job_and_its_result(tmp_path):
+    accepting, polling = make_queue(tmp_path), make_queue(tmp_path)
+    release = threading.Event()
+
+    job = accepting.submit(lambda: release.wait(5) and {'faces_detected': 2})
+    assert polling.get(job.id).status in ('queued', 'running')
+
+    release.set()
+    accepting._executor.get().shutdown(wait=True)
+    seen = polling.get(job.id)
+    assert seen.status == 'done'
+    assert seen.result == {'faces_detected': 2}
+
+
+def test_failed_jobs_keep_their_error(tmp_path):
+    queue = make_queue(tmp_path)
+
+    def fail():
+        raise ValueError('bad image')
+
+    job = queue.submit(fail)
+    queue._executor.get().shutdown(wait=True)
+    assert queue.get(job.id).status == 'failed'
+    assert queue.get(job.id).error == 'bad image'
+
+
+def test_oldest_finished_jobs_are_dropped_past_the_limit(tmp_path):
+    queue = make_queue(tmp_path, max_finished=2)
+    jobs = [queue.submit(dict) for _ in range(3)]
+    queue._executor.get().shutdown(wait=True)
+    assert queue.get(jobs[0].id) is None
+    assert all(queue.get(job.id).status == 'done' for job in jobs[1:])
+
+
+def test_unknown_and_unsafe_ids_are_not_found(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.get('missing') is None
+    assert queue.get('../jobs') is None
@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+from metadata import strip_metadata
+
+CAMERA = 'SecretCam'
+XMP = b'<x:xmpmeta xmlns:x="adobe:ns:meta/">SecretXmp</x:xmpmeta>'
+TEXT = 'SecretAuthor'
+# WebP has no text comments, only EXIF and XMP
+SECRETS = {
+    'JPEG': (CAMERA.encode(), b'SecretXmp', TEXT.encode()),
+    'PNG': (CAMERA.encode(), b'SecretXmp', TEXT.encode()),
+    'WEBP': (CAMERA.encode(), b'SecretXmp'),
+}
+
+
+def make_image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+
+
+def encode_with_metadata(image_format):
+    exif = Image.Exif()
+    exif[0x0110] = CAMERA  # Model
+    options = {'exif': exif}
+    if image_format == 'JPEG':
+        options.update(xmp=XMP, comment=TEXT.encode(), quality=90)
+    elif image_format == 'PNG':
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Author', TEXT)
+        info.add_itxt('XML:com.adobe.xmp', XMP.decode())
+        options['pnginfo'] = info
+    else:
+        options.update(xmp=XMP, lossless=True)
+    buffer = io.BytesIO()
+    make_image().save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('image_format', ['JPEG', 'PNG', 'WEBP'])
+def test_metadata_is_removed_and_pixels_are_unchanged(image_format):
+    data = encode_with_metadata(image_format)
+    assert all(secret in data for secret in SECRETS[image_format])
+
+    stripped = strip_metadata(data, image_format)
+
+    assert not any(secret in stripped for secret in SECRETS[image_format])
+    with Image.open(io.BytesIO(stripped)) as image:
+        assert not {'exif', 'xmp', 'XML:com.adobe.xmp', 'Author', 'comment'} & set(image.info)
+        assert not image.getexif()
+        stripped_pixels = np.asarray(image.convert('RGB'))
+    with Image.open(io.BytesIO(data)) as image:
+        original_pixels = np.asarray(image.convert('RGB'))
+    assert np.array_equal(stripped_pixels, original_pixels)
+
+
+def test_jpeg_trailer_after_end_of_image_is_dropped():
+    data = encode_with_metadata('JPEG')
+    appended = data + b'motion photo ' + CAMERA.encode()
+    assert strip_metadata(appended, 'JPEG') == strip_metadata(data, 'JPEG')
+
+
+@pytest.mark.parametrize('image_format', ['JPEG', 'PNG', 'WEBP'])
+def test_truncated_files_are_rejected(image_format):
+    data = encode_with_metadata(image_format)
+    with pytest.raises(ValueError):
+        strip_metadata(data[:len(data) // 2], image_format)
+
+
+def test_unsupported_format_is_rejected():
+    with pytest.raises(ValueError):
+        strip_metadata(b'GIF89a', 'GIF')
@@ -0,0 +1,25 @@
+from metrics import ProcessingMetrics
+
+TIMINGS = {'decode': 12.0, 'blur': 30.0}
+
+
+def test_workers_sharing_a_directory_serve_the_sum(tmp_path):
+    first, second = ProcessingMetrics(directory=str(tmp_path)), ProcessingMetrics(directory=str(tmp_path))
+    first.observe('upload', 'server', 2.0, TIMINGS, 50)
+    second.observe('upload', 'server', 2.0, TIMINGS, 70)
+    second.observe_failure('upload', 'rejected')
+
+    for rendered in (first.render(), second.render()):
+        assert 'privacy_shield_processed_total{endpoint="upload",outcome="success"} 2.0' in rendered
+        assert 'privacy_shield_processed_total{endpoint="upload",outcome="rejected"} 1.0' in rendered
+        assert ('privacy_shield_processing_seconds_count{endpoint="upload",detection_method="server",'
+                'size_mp="1-4"} 2.0') in rendered
+        assert ('privacy_shield_stage_seconds_bucket{stage="blur",detection_method="server",size_mp="1-4",'
+                'le="0.05"} 2.0') in rendered
+
+
+def test_without_a_directory_metrics_stay_in_the_process():
+    first, second = ProcessingMetrics(), ProcessingMetrics()
+    first.observe_failure('batch')
+    assert 'outcome="error"} 1.0' in first.render()
+    assert 'outcome="error"' not in second.render()
@@ -0,0 +1,42 @@
+import os
+import threading
+
+import pytest
+
+from process_local import ProcessLocal
+
+
+def test_value_is_built_once_per_process():
+    built = []
+    local = ProcessLocal(lambda: built.append(1) or object())
+    threads = [threading.Thread(target=local.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert local.get() is local.get()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_child_builds_its_own_value():
+    local = ProcessLocal(os.getpid)
+    assert local.get() == os.getpid()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_end, str(local.get()).encode())
+        os._exit(0)
+    os.close(write_end)
+    child_value = int(os.read(read_end, 32))
+    os.waitpid(pid, 0)
+    assert child_value == pid
+    assert local.get() == os.getpid()
+
+
+def test_reset_returns_the_old_value_and_rebuilds():
+    local = ProcessLocal(object)
+    first = local.get()
+    assert local.reset() is first
+    assert local.reset() is None
+    assert local.get() is not first
@@ -0,0 +1,40 @@
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def age(cache, key, seconds):
+    path = cache._path(key)
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+
+def test_expired_entries_are_missed_and_swept(tmp_path):
+    cache = ResultCache(str(tmp_path), 1024, ttl=60)
+    cache.put('fresh', b'new', {})
+    cache.put('stale', b'old', {})
+    age(cache, 'stale', 120)
+
+    assert cache.get('stale') is None
+    assert cache.get('fresh') == (b'new', {})
+    cache.sweep()
+    assert not os.path.exists(cache._path('stale'))
+    assert cache.stats()['expired'] == 1
+
+
+def test_reads_keep_entries_from_eviction_but_not_from_expiry(tmp_path):
+    cache = ResultCache(str(tmp_path), 20, ttl=60)
+    cache.put('first', b'12345', {})
+    cache.put('second', b'12345', {})
+    age(cache, 'first', 30)
+    age(cache, 'second', 20)
+    written_at = os.stat(cache._path('first')).st_mtime
+    assert cache.get('first') is not None
+    assert os.stat(cache._path('first')).st_mtime == written_at
+
+    cache.put('third', b'12345', {})
+    cache.sweep()
+    assert cache.get('second') is None
+    assert cache.get('first') is not None
+    assert time.time() - os.stat(cache._path('first')).st_mtime >= 30
@@ -0,0 +1,84 @@
+import os
+import math
+from contextlib import contextmanager
+
+import numpy as np
+
+# Most pixel-buffer memory one request may use, in MB; requests may ask for less
+MEMORY_BUDGET_MB = int(os.environ.get('MEMORY_BUDGET_MB', 512))
+# Tile size for detection in tiled mode
+TILED_DETECTION_TILE = int(os.environ.get('TILED_DETECTION_TILE', 640))
+# Bytes per pixel the in-memory path holds on top of the decoded image: the
+# RGB and BGR arrays, a grayscale copy and the reassembled output image
+IN_MEMORY_EXTRA_BYTES_PER_PIXEL = 10
+PROCESSING_MODES = ('auto', 'full', 'tiled')
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when processing an image would need more memory than its budget"""
+
+
+class MemoryBudget:
+    """Accounts for the large pixel buffers a request holds, and their estimated peak
+
+    Sizes are computed from image dimensions before buffers are allocated,
+    so the peak is an estimate of pixel memory, not a measurement of the
+    process's allocations.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.current = 0
+        self.estimated_peak = 0
+
+    def reserve(self, nbytes, what):
+        """Count nbytes as held, or raise MemoryBudgetExceeded if that is over the limit"""
+        if self.limit and self.current + nbytes > self.limit:
+            raise MemoryBudgetExceeded(f"{what} needs {nbytes / 1024 / 1024:.0f}MB, "
+                                       f"over the {self.limit / 1024 / 1024:.0f}MB memory budget")
+        self.current += nbytes
+        self.estimated_peak = max(self.estimated_peak, self.current)
+
+    def release(self, nbytes):
+        self.current -= nbytes
+
+    @contextmanager
+    def holding(self, nbytes, what):
+        """Count nbytes as held for the duration of the block"""
+        self.reserve(nbytes, what)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    @property
+    def estimated_peak_mb(self):
+        return round(self.estimated_peak / 1024 / 1024, 1)
+
+
+def decoded_bytes(image):
+    """Memory of a PIL image's decoded pixels"""
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+def in_memory_peak_bytes(image):
+    """Memory the in-memory path needs at its peak for a PIL image"""
+    width, height = image.size
+    return decoded_bytes(image) + width * height * IN_MEMORY_EXTRA_BYTES_PER_PIXEL
+
+
+def detection_image(image, max_edge, color=False):
+    """Grayscale (or BGR, with color) array of a PIL image shrunk to fit max_edge, and its scale
+
+    The image is box-reduced before converting, so no full-size grayscale
+    or NumPy copy is made.
+    """
+    factor = max(1, math.ceil(max(image.size) / max_edge)) if max_edge else 1
+    small = image.reduce(factor) if factor > 1 else image
+    if color:
+        # Reverse the channels for OpenCV's BGR order
+        array = np.ascontiguousarray(np.asarray(small.convert('RGB'))[:, :, ::-1])
+    else:
+        array = np.asarray(small.convert('L'))
+    return array, array.shape[1] / image.size[0]
@@ -0,0 +1,210 @@
+import os
+import logging
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from detection import box_iou_matrix
+from detectors import get_detector
+
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'webm', 'avi'}
+# Haar detection runs on every Nth frame; boxes are tracked in between
+VIDEO_KEYFRAME_INTERVAL = int(os.environ.get('VIDEO_KEYFRAME_INTERVAL', 10))
+# Longest clip accepted, in frames
+VIDEO_MAX_FRAMES = int(os.environ.get('VIDEO_MAX_FRAMES', 1800))
+
+# Keyframes a tracked face survives without a matching detection, so a face
+# the detector misses for a moment (profile, motion blur) stays blurred
+TRACK_PATIENCE = 2
+# Overlap needed for a detection to continue an existing track
+TRACK_MATCH_IOU = 0.3
+# Corners followed by optical flow inside each face box
+TRACK_POINTS = 30
+# Fewest corners that must be followed for a box to move
+MIN_TRACKED_POINTS = 4
+
+# Codecs tried for each container, in order of preference; browsers play
+# H.264 but not every OpenCV build can encode it
+VIDEO_CODECS = {
+    'mp4': ('avc1', 'mp4v'),
+    'mov': ('avc1', 'mp4v'),
+    'webm': ('VP90', 'VP80'),
+    'avi': ('MJPG',),
+}
+_working_codecs = {}
+
+
+class FaceTracker:
+    """Face boxes for each frame of a clip: detected on keyframes, followed by optical flow in between"""
+
+    def __init__(self, detector=None, keyframe_interval=VIDEO_KEYFRAME_INTERVAL, patience=TRACK_PATIENCE):
+        self.detector = detector or get_detector()
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.patience = patience
+        self.frame_index = 0
+        self.tracks = []  # [box as float32 (x, y, w, h), keyframes missed]
+        self.faces_seen = 0
+        self._prev_gray = None
+
+    def update(self, frame):
+        """Integer (x, y, w, h) boxes to blur in this BGR frame"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.frame_index % self.keyframe_interval == 0:
+            self._detect(frame if self.detector.uses_color else gray)
+        elif self.tracks:
+            self._follow(gray)
+        self._prev_gray = gray
+        self.frame_index += 1
+        return [tuple(int(round(v)) for v in box) for box, _ in self.tracks]
+
+    def _detect(self, image):
+        detections = [np.array(box, dtype=np.float32) for box, _ in self.detector.detect(image)]
+        matched = set()
+        if self.tracks and detections:
+            ious = box_iou_matrix(np.array([box for box, _ in self.tracks]), np.array(detections))
+            for track_index, track in enumerate(self.tracks):
+                best = int(np.argmax(ious[track_index]))
+                if ious[track_index, best] >= TRACK_MATCH_IOU and best not in matched:
+                    matched.add(best)
+                    track[0] = detections[best]
+                    track[1] = 0
+                else:
+                    track[1] += 1
+        else:
+            for track in self.tracks:
+                track[1] += 1
+
+        self.tracks = [track for track in self.tracks if track[1] <= self.patience]
+        for index, box in enumerate(detections):
+            if index not in matched:
+                self.tracks.append([box, 0])
+                self.faces_seen += 1
+
+    def _follow(self, gray):
+        height, width = gray.shape
+        # Collect corners from every box and run one optical flow pass for all of them
+        points = []
+        owners = []
+        for track_index, (box, _) in enumerate(self.tracks):
+            x, y, w, h = (int(v) for v in box)
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 - x0 < 2 or y1 - y0 < 2:
+                continue
+            corners = cv2.goodFeaturesToTrack(self._prev_gray[y0:y1, x0:x1], TRACK_POINTS, 0.01, 3)
+            if corners is None:
+                continue
+            points.append(corners.reshape(-1, 2) + (x0, y0))
+            owners.extend([track_index] * len(corners))
+        if not points:
+            return
+
+        points = np.concatenate(points).astype(np.float32)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None)
+        owners = np.array(owners)
+        ok = status.ravel() == 1
+        for track_index, track in enumerate(self.tracks):
+            mask = ok & (owners == track_index)
+            # Boxes that can't be followed stay where they were until the next keyframe
+            if mask.sum() >= MIN_TRACKED_POINTS:
+                shift = np.median(moved[mask] - points[mask], axis=0)
+                track[0] = track[0] + np.array([shift[0], shift[1], 0, 0], dtype=np.float32)
+
+
+class VideoReader:
+    """Decode a video file one frame at a time"""
+
+    def __init__(self, path, max_frames=VIDEO_MAX_FRAMES):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError("Could not open video")
+        self.max_frames = max_frames
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def __iter__(self):
+        count = 0
+        while True:
+            ok, frame = self.capture.read()
+            if not ok:
+                return
+            count += 1
+            if count > self.max_frames:
+                raise ValueError(f"Video is longer than {self.max_frames} frames")
+            yield frame
+
+    def close(self):
+        self.capture.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_video_writer(path, extension, fps, size):
+    """cv2.VideoWriter for a container, using the first codec this OpenCV build can encode"""
+    codecs = VIDEO_CODECS[extension]
+    if extension in _working_codecs:
+        codecs = (_working_codecs[extension],)
+    for codec in codecs:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            _working_codecs[extension] = codec
+            return writer
+        writer.release()
+        logging.debug(f"Codec {codec} unavailable for .{extension}")
+    raise ValueError(f"No video encoder available for .{extension}")
+
+
+def iter_animation_frames(image, max_frames=VIDEO_MAX_FRAMES):
+    """(BGR array, alpha, duration ms) for each frame of an animated image, decoded as needed"""
+    if image.n_frames > max_frames:
+        raise ValueError(f"Animation is longer than {max_frames} frames")
+    for index in range(image.n_frames):
+        image.seek(index)
+        rgba = np.asarray(image.convert('RGBA'))
+        yield cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR), rgba[:, :, 3], image.info.get('duration', 100)
+
+
+class AnimationFrames(Image.Image):
+    """Multi-frame image whose frames are produced one at a time as the encoder seeks
+
+    Pillow's animated WebP writer encodes frame by frame but expects every
+    frame up front; handing it this image instead means only the frame being
+    encoded is held in memory. Frames must be read in order.
+    """
+
+    def __init__(self, frames, n_frames):
+        super().__init__()
+        self._frames = iter(frames)
+        self.n_frames = n_frames
+        self.is_animated = n_frames > 1
+        self.durations = []
+        self._index = -1
+        self._next_frame()
+
+    def _next_frame(self):
+        frame, duration = next(self._frames)
+        self.im = frame.im
+        self._mode = frame.mode
+        self._size = frame.size
+        self.durations.append(duration)
+        self._index += 1
+
+    def seek(self, frame):
+        # The encoder seeks back to the first frame when done; that is a no-op
+        while self._index < frame:
+            self._next_frame()
+
+    def tell(self):
+        return self._index
+
+
+def save_animated_webp(path, frames, n_frames, loop=0, quality=95):
+    """Encode (PIL image, duration ms) frames to an animated WebP at path"""
+    animation = AnimationFrames(frames, n_frames)
+    animation.save(path, 'WEBP', save_all=True, duration=animation.durations, loop=loop, quality=quality)